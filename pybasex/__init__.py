@@ -10,3 +10,10 @@ The main features include:
 """
 
 from basex_client import BaseXClient
+from async_client import AsyncBaseXClient
+from cache import QueryCache
+from hedging import HedgingPolicy
+from instrumentation import Instrumentation, MetricsCollector
+from socket_client import BaseXSocketClient
+from sync import SyncManifest
+from transports import HTTPTransport, SocketTransport, Transport
@@ -0,0 +1,87 @@
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection, HTTPSConnection
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# per thread state of the requests sent through ClientAdapter
+_state = threading.local()
+
+
+def current_attempt():
+    # the attempt of a hedged request (see hedging.Attempt) running on this thread, if any
+    return getattr(_state, 'attempt', None)
+
+
+def set_current_attempt(attempt):
+    _state.attempt = attempt
+
+
+def reset_request_sent():
+    _state.sent = None
+
+
+def mark_request_sent():
+    _state.sent = time.time()
+
+
+def request_sent():
+    # when the last request of this thread was completely sent (headers and body),
+    # None if it is unknown
+    return getattr(_state, 'sent', None)
+
+
+class _ObservedConnectionMixin(object):
+
+    def putrequest(self, *args, **kwargs):
+        attempt = current_attempt()
+        if attempt is not None:
+            attempt.track(self)
+        return super(_ObservedConnectionMixin, self).putrequest(*args, **kwargs)
+
+    def connect(self):
+        super(_ObservedConnectionMixin, self).connect()
+        # the attempt could have been aborted while the connection was not open yet
+        attempt = current_attempt()
+        if attempt is not None:
+            attempt.track(self)
+
+    def endheaders(self, *args, **kwargs):
+        # sends the headers and, unless it is chunked, the body
+        super(_ObservedConnectionMixin, self).endheaders(*args, **kwargs)
+        mark_request_sent()
+
+    def request_chunked(self, *args, **kwargs):
+        super(_ObservedConnectionMixin, self).request_chunked(*args, **kwargs)
+        mark_request_sent()
+
+
+class _ObservedHTTPConnection(_ObservedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _ObservedHTTPSConnection(_ObservedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _ObservedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _ObservedHTTPConnection
+
+
+class _ObservedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _ObservedHTTPSConnection
+
+
+class ClientAdapter(HTTPAdapter):
+    """
+    Transport adapter of the BaseXClient sessions: its connections record when a request
+    has been sent (see instrumentation) and are tracked by the attempt of a hedged request
+    using them, that can shut them down (see hedging).
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _ObservedHTTPConnectionPool,
+            'https': _ObservedHTTPSConnectionPool,
+        }
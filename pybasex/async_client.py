@@ -0,0 +1,157 @@
+import threading
+from multiprocessing.pool import ThreadPool
+
+import errors as pbx_errors
+import utils as pbx_utils
+from basex_client import BaseXClient
+
+
+class AsyncBaseXClient(object):
+    """
+    Non-blocking counterpart of BaseXClient: every method is scheduled on a bounded
+    pool of worker threads (each one owning its own HTTP session) and immediately
+    returns an AsyncResult; call .get() on it to obtain the value or the exception
+    raised by the underlying BaseXClient method.
+    """
+
+    def __init__(self, url, default_database=None, user=None, password=None,
+                 logger=None, max_concurrency=10, query_cache=None, instrumentation=None,
+                 catalog_ttl=None):
+        if max_concurrency < 1:
+            raise pbx_errors.ConfigurationError('max_concurrency must be a positive integer')
+        self.url = url
+        self.default_database = default_database
+        self.user = user
+        self.password = password
+        self.logger = logger or pbx_utils.get_logger('basex_client')
+        self.max_concurrency = max_concurrency
+        # shared by all the workers, cache.QueryCache is thread safe
+        self.query_cache = query_cache
+        # shared as well, instrumentation.MetricsCollector is thread safe
+        self.instrumentation = instrumentation
+        # every worker keeps its own databases catalog
+        self.catalog_ttl = catalog_ttl
+        self.pool = None
+        self._local = threading.local()
+        self._clients = list()
+        self._clients_lock = threading.Lock()
+
+    def __del__(self):
+        self.disconnect()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
+        return None
+
+    def connect(self):
+        self.logger.debug('Creating workers pool (%d workers)', self.max_concurrency)
+        self.pool = ThreadPool(self.max_concurrency)
+
+    def disconnect(self):
+        self.logger.debug('Closing workers pool')
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+        self.pool = None
+        with self._clients_lock:
+            for client in self._clients:
+                client.disconnect()
+            self._clients = list()
+        self._local = threading.local()
+
+    @property
+    def connected(self):
+        return not(self.pool is None)
+
+    def _check_connection(self):
+        if not self.connected:
+            raise pbx_errors.ConnectionClosedError('Connection closed')
+
+    def _get_client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = BaseXClient(self.url, default_database=self.default_database,
+                                 user=self.user, password=self.password, logger=self.logger,
+                                 query_cache=self.query_cache,
+                                 instrumentation=self.instrumentation,
+                                 catalog_ttl=self.catalog_ttl)
+            client.connect()
+            self._local.client = client
+            with self._clients_lock:
+                self._clients.append(client)
+        return client
+
+    def _call(self, method_name, args, kwargs):
+        return getattr(self._get_client(), method_name)(*args, **kwargs)
+
+    def _submit(self, method_name, *args, **kwargs):
+        self._check_connection()
+        return self.pool.apply_async(self._call, (method_name, args, kwargs))
+
+    @staticmethod
+    def gather(async_results, timeout=None):
+        return [r.get(timeout) for r in async_results]
+
+    # --- objects creation methods
+    def create_database(self, database=None):
+        return self._submit('create_database', database)
+
+    def add_document(self, xml_doc, document_id=None, database=None):
+        return self._submit('add_document', xml_doc, document_id, database)
+
+    def add_documents(self, documents, database=None, skip_duplicated=False, max_workers=None,
+                      chunk_size=None):
+        return self._submit('add_documents', documents, database, skip_duplicated, max_workers,
+                            chunk_size)
+
+    def ingest(self, source, chunk_size=None, database=None, progress=None):
+        return self._submit('ingest', source, chunk_size, database, progress)
+
+    def sync_documents(self, documents, database=None, manifest=None, delete_missing=False,
+                       chunk_size=None):
+        return self._submit('sync_documents', documents, database, manifest, delete_missing,
+                            chunk_size)
+
+    # --- objects retrieval methods
+    def document_exists(self, document_id, database=None):
+        return self._submit('document_exists', document_id, database)
+
+    def get_databases(self):
+        return self._submit('get_databases')
+
+    def database_exists(self, database=None):
+        return self._submit('database_exists', database)
+
+    def get_resources(self, database=None):
+        return self._submit('get_resources', database)
+
+    def get_document(self, document_id, database=None, result_format='xml'):
+        return self._submit('get_document', document_id, database, result_format)
+
+    def get_documents(self, database=None, batch_size=None, result_format='xml'):
+        return self._submit('get_documents', database, batch_size, result_format)
+
+    # --- objects deletion methods
+    def delete_database(self, database=None):
+        return self._submit('delete_database', database)
+
+    def delete_document(self, document_id, database=None):
+        return self._submit('delete_document', document_id, database)
+
+    # --- commands\queries execution methods
+    def execute_query(self, query, database=None, variables=None, result_format='xml', cache=True,
+                      hedge=False, primary=False):
+        return self._submit('execute_query', query, database, variables, result_format, cache,
+                            hedge=hedge, primary=primary)
+
+    def execute_query_many(self, query, databases, concurrency=10, variables=None,
+                           result_format='xml', timeout=None, order_by=None):
+        return self._submit('execute_query_many', query, databases, concurrency, variables,
+                            result_format, timeout, order_by)
+
+    def execute_queries(self, queries, database=None, variables=None):
+        return self._submit('execute_queries', queries, database, variables)
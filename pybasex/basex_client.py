@@ -1,23 +1,147 @@
+import logging
+import os
 import requests
+import threading
+import time
+import types
+import weakref
+from contextlib import contextmanager
+from copy import deepcopy
+from lxml import etree
 from functools import wraps
+from multiprocessing.pool import ThreadPool
 from uuid import uuid4
 
 import errors as pbx_errors
+from adapters import current_attempt, reset_request_sent, request_sent
+from instrumentation import CallRecord
+from hedging import HedgedRace, HedgeScheduler
+from nodes import NodesPool
+from writer import BufferedWriter
+from documents import LazyDocuments
+from fanout import FanOutResults
+from sync import SyncManifest, document_hash
+from transports import HTTPTransport
 import utils as pbx_utils
 import utils.xml_utils as pbx_xml_utils
-from fragments import build_query_fragment
+from fragments import build_query_fragment, build_update_fragment, build_exists_fragment, \
+    build_documents_fragment, build_documents_by_path_fragment, build_page_query, \
+    build_document_fragment, build_serialized_documents_fragment, serialization_parameters, \
+    build_batch_query, variables_dict, BATCH_ERROR_TAG, PAGE_ITEM_TAG
+
+
+def _is_read_only(f, kwargs):
+    # see read_only and read_only_if
+    read_only = getattr(f, 'read_only', False)
+    if isinstance(read_only, basestring):
+        return bool(kwargs.get(read_only))
+    return read_only
+
+
+def read_only(f):
+    # marks methods that can be safely sent to more than one node (see hedging)
+    f.read_only = True
+    return f
+
+
+def read_only_if(argument):
+    # as read_only, but only for the calls where the given keyword argument is true
+    def decorator(f):
+        f.read_only = argument
+        return f
+    return decorator
+
+
+def errors_handler(f):
+    @wraps(f)
+    def wrapper(inst, *args, **kwargs):
+        inst._check_connection()
+        call = inst._start_call(f.__name__)
+        streamed = False
+        try:
+            if _is_read_only(f, kwargs) and inst._hedging_pool is not None \
+                    and not getattr(inst._local, 'hedged', False):
+                result = inst._hedged_call(f, args, kwargs)
+            else:
+                result = f(inst, *args, **kwargs)
+            if call is not None and isinstance(result, types.GeneratorType):
+                streamed = True
+                return inst._recorded_stream(result, call)
+            return result
+        except requests.ConnectionError, ce:
+            error = inst._connection_error(ce)
+            if call is not None:
+                call.error = type(error).__name__
+            raise error
+        except Exception, e:
+            if call is not None:
+                call.error = type(e).__name__
+            raise
+        finally:
+            if streamed:
+                inst._local.call = None
+            else:
+                inst._finish_call(call)
+    return wrapper
+
+
+class _SessionHolder(object):
+    # kept in the thread local storage of the client, released when the thread exits
+    __slots__ = ('session', '__weakref__')
+
+    def __init__(self, session):
+        self.session = session
 
 
 class BaseXClient(object):
 
+    STREAM_CHUNK_SIZE = 64 * 1024
+    DOCUMENTS_BATCH_SIZE = 1000
+    INGEST_CHUNK_SIZE = 100
+    INGEST_EXTENSIONS = ('.xml',)
+    RAW_CONTENT_TYPE = 'application/octet-stream'
+    EMPTY_LISTING_PREFIX = '<rest:database'
+
     def __init__(self, url, default_database=None,
-                 user=None, password=None, logger=None):
-        self.url = url
+                 user=None, password=None, logger=None, track_ids=False,
+                 query_cache=None, read_strategy='round_robin', eject_timeout=30,
+                 pool_connections=10, pool_maxsize=10, keep_alive=True, hedging=None,
+                 instrumentation=None, catalog_ttl=None, transport=None):
+        # url can be a list of nodes URLs: the first one is the primary node, used for
+        # writes, reads are spread among all the healthy nodes
+        self.nodes = NodesPool([url] if isinstance(url, basestring) else url,
+                               read_strategy, eject_timeout)
+        self.url = self.nodes.primary
         self.default_database = default_database
         self.user = user
         self.password = password
         self.logger = logger or pbx_utils.get_logger('basex_client')
-        self.session = None
+        # sessions are created on demand, one for each thread (see session)
+        self._connected = False
+        self._pid = os.getpid()
+        self._sessions = dict()
+        self._sessions_lock = threading.RLock()
+        # client side index of the documents IDs, seeded once per database by get_resources
+        self.track_ids = track_ids
+        self._ids_index = dict()
+        # a cache.QueryCache instance, invalidated by every write performed by this client
+        self.query_cache = query_cache
+        # a transports.Transport instance, by default the BaseX REST interface (the pool
+        # and keep alive options are the ones of its HTTP connections)
+        self.transport = transport or HTTPTransport(pool_connections, pool_maxsize, keep_alive)
+        # a hedging.HedgingPolicy instance, enables hedged read requests
+        self.hedging = hedging
+        self._hedging_pool = None
+        self._hedging_scheduler = None
+        self._hedging_sessions = list()
+        # an instrumentation.Instrumentation instance, notified around every method call
+        self.instrumentation = instrumentation
+        # names of the existing databases, as listed by get_databases, are trusted for
+        # catalog_ttl seconds (None disables the catalog)
+        self.catalog_ttl = catalog_ttl
+        self._catalog = None
+        self._catalog_expires = 0
+        self._local = threading.local()
 
     def __del__(self):
         self.disconnect()
@@ -30,42 +154,314 @@ class BaseXClient(object):
         self.disconnect()
         return None
 
+    # runtime state, not pickled: rebuilt (and the client reconnected) by __setstate__
+    _RUNTIME_ATTRS = ('_local', '_sessions', '_sessions_lock', '_hedging_pool', '_hedging_scheduler',
+                      '_hedging_sessions')
+
+    def __getstate__(self):
+        state = dict((k, v) for k, v in self.__dict__.iteritems() if k not in self._RUNTIME_ATTRS)
+        state['logger'] = self.logger.name
+        # what is known about the databases would go stale in the other process, it is
+        # fetched again from BaseX when needed (as the query cache, emptied when pickled)
+        state.update(_ids_index=dict(), _catalog=None, _catalog_expires=0)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.logger = logging.getLogger(state['logger'])
+        self._pid = os.getpid()
+        self._sessions = dict()
+        self._sessions_lock = threading.RLock()
+        self._hedging_pool = None
+        self._hedging_scheduler = None
+        self._hedging_sessions = list()
+        self._local = threading.local()
+        if self._connected:
+            self._connected = False
+            self.connect()
+
+    def _new_session(self):
+        return self.transport.new_session(self.user, self.password)
+
+    def _init_hedging_worker(self):
+        self._local.session = self._new_session()
+        self._hedging_sessions.append(self._local.session)
+
+    def _start_hedging_pool(self):
+        # the workers only run the hedges, first attempts run on the calling threads
+        self._hedging_sessions = list()
+        self._hedging_pool = ThreadPool(self.hedging.pool_size, self._init_hedging_worker)
+        self._hedging_scheduler = HedgeScheduler()
+
     def connect(self):
         self.logger.debug('Creating session')
-        self.session = requests.Session()
-        if self.user and self.password:
-            self.session.auth = (self.user, self.password)
+        self._check_fork()
+        self._connected = True
+        # the session of the connecting thread is created right away, as before
+        try:
+            self.transport.open(self.session, self.url)
+        except requests.ConnectionError, ce:
+            raise self._connection_error(ce)
+        if self.hedging is not None:
+            self._start_hedging_pool()
 
     def disconnect(self):
         self.logger.debug('Closing session')
-        if self.session:
-            self.session.close()
-        self.session = None
-
-    def errors_handler(f):
-        @wraps(f)
-        def wrapper(inst, *args, **kwargs):
-            inst._check_connection()
+        # sessions inherited from a parent process are dropped, never closed
+        self._check_fork()
+        self._connected = False
+        with self._sessions_lock:
+            sessions = self._sessions.values()
+            self._sessions.clear()
+        for s in sessions:
+            s.close()
+        if self._hedging_pool:
+            self._hedging_scheduler.close()
+            self._hedging_pool.close()
+            self._hedging_pool.join()
+            for s in self._hedging_sessions:
+                s.close()
+        self._hedging_pool = None
+        self._hedging_scheduler = None
+        self._hedging_sessions = list()
+        self._local = threading.local()
+
+    def _check_fork(self):
+        # a forked child can't use the connections, threads and locks of its parent:
+        # sessions and the hedging pool are replaced, the parent keeps using its own
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+        pbx_utils.reset_logger_locks(self.logger)
+        self.logger.debug('Fork detected (process %d), resetting sessions', pid)
+        self.nodes.after_fork()
+        self._local = threading.local()
+        self._sessions = dict()
+        self._sessions_lock = threading.RLock()
+        self._hedging_pool = None
+        self._hedging_scheduler = None
+        if self._connected and self.hedging is not None:
+            self._start_hedging_pool()
+        self._pid = pid
+
+    @property
+    def session(self):
+        # the session of the calling thread, created on first use: sessions are never
+        # shared among threads, nor with the parent process after a fork
+        if not self._connected:
+            return None
+        self._check_fork()
+        holder = getattr(self._local, 'session_holder', None)
+        if holder is None:
+            holder = self._local.session_holder = self._register_session(self._new_session())
+        return holder.session
+
+    def _register_session(self, session):
+        # the session is closed as soon as its thread exits (when the thread local holder is
+        # released), the callback must not reference the client (see __del__)
+        holder = _SessionHolder(session)
+        sessions, lock, pid = self._sessions, self._sessions_lock, os.getpid()
+
+        def thread_exited(ref):
+            if os.getpid() != pid:
+                # released by a forked child (see _check_fork), the session is the parent's
+                return
+            with lock:
+                released = sessions.pop(ref, None)
+            if released is not None:
+                released.close()
+        with lock:
+            sessions[weakref.ref(holder, thread_exited)] = session
+        return holder
+
+    # --- instrumentation
+    def _start_call(self, operation):
+        # only the outermost call is recorded, nested ones are accounted to it
+        if self.instrumentation is None or getattr(self._local, 'call', None) is not None:
+            return None
+        call = CallRecord(operation)
+        self._local.call = call
+        self.instrumentation.call_started(call)
+        return call
+
+    def _finish_call(self, call):
+        if call is None:
+            return
+        call.finish()
+        self._local.call = None
+        self.instrumentation.call_finished(call)
+
+    def _recorded_stream(self, items, call):
+        # the call of a method returning a generator is recorded when the generator is
+        # exhausted or closed, the requests sent while iterating are accounted to it
+        try:
+            while True:
+                previous = getattr(self._local, 'call', None)
+                self._local.call = call
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                except Exception, e:
+                    call.error = type(e).__name__
+                    raise
+                finally:
+                    self._local.call = previous
+                yield item
+        finally:
+            items.close()
+            call.finish()
+            self.instrumentation.call_finished(call)
+
+    @contextmanager
+    def _timed(self, phase):
+        call = getattr(self._local, 'call', None)
+        start = time.time()
+        try:
+            yield
+        finally:
+            if call is not None:
+                call.add_phase(phase, time.time() - start)
+
+    def _record_response(self, response, start, data=None, stream=False):
+        call = getattr(self._local, 'call', None)
+        if call is None:
+            return
+        now = time.time()
+        # response.elapsed goes from the beginning of the request to the arrival of the
+        # response headers, the transport tells when the request has been sent (see
+        # adapters.request_sent)
+        headers_received = min(now, start + response.elapsed.total_seconds())
+        sent = request_sent()
+        if sent is None or not start <= sent <= headers_received:
+            sent = start
+        call.add_phase('request', sent - start)
+        call.add_phase('server', headers_received - sent)
+        if stream:
+            # the body is received (and accounted, see _iter_content) while it is consumed
+            bytes_received = 0
+        else:
+            call.add_phase('response', now - headers_received)
+            bytes_received = len(response.content)
+        call.add_response(response.status_code,
+                          len(data) if isinstance(data, basestring) else 0, bytes_received)
+
+    def _iter_content(self, response, chunk_size):
+        # body of a streamed response, the time spent receiving it and its size are
+        # accounted to the current call chunk by chunk
+        chunks = response.iter_content(chunk_size)
+        while True:
+            start = time.time()
             try:
-                return f(inst, *args, **kwargs)
-            except requests.ConnectionError, ce:
-                inst.logger.exception(ce)
-                raise pbx_errors.ConnectionError('Unable to connect to "%s"' % inst.url)
-        return wrapper
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            call = getattr(self._local, 'call', None)
+            if call is not None:
+                call.add_phase('response', time.time() - start)
+                call.add_bytes_received(len(chunk))
+            yield chunk
+
+    def _parse_response(self, content):
+        with self._timed('parse'):
+            return pbx_xml_utils.bytes_to_xml(content)
+
+    def _hedged_attempt(self, f, args, kwargs, node, race, attempt, call=None):
+        # runs pinned to the given node, on the calling thread (the first attempt) or on a
+        # hedging worker, with its own session
+        previous = (getattr(self._local, 'hedged', False), getattr(self._local, 'node', None),
+                    getattr(self._local, 'call', None))
+        self._local.hedged = True
+        self._local.node = node
+        self._local.call = call
+        try:
+            with race.attempts[attempt]:
+                value = f(self, *args, **kwargs)
+        except Exception, e:
+            race.finish(attempt, False, e)
+        else:
+            race.finish(attempt, True, value)
+        finally:
+            self._local.hedged, self._local.node, self._local.call = previous
+
+    def _fire_hedge(self, f, args, kwargs, node, race, call):
+        # runs on the hedging scheduler thread
+        if not race.fire():
+            return
+        self.logger.debug('No response after the hedging delay, hedging request to "%s"', node)
+        pool = self._hedging_pool
+        if pool is not None:
+            try:
+                pool.apply_async(self._hedged_attempt, (f, args, kwargs, node, race, 1, call))
+                return
+            except ValueError:
+                # the pool has been closed meanwhile
+                pass
+        race.finish(1, False, pbx_errors.ConnectionClosedError('Client disconnected'))
+
+    def _hedged_call(self, f, args, kwargs):
+        first_node = self.nodes.select(read=True)
+        # with a single healthy node the hedge goes to the same node, on another connection
+        second_node = self.nodes.select(read=True, exclude=[first_node]) or first_node
+        race = HedgedRace()
+        call = getattr(self._local, 'call', None)
+        start = time.time()
+        self._hedging_scheduler.schedule(self.hedging.delay(), lambda: self._fire_hedge(
+            f, args, kwargs, second_node, race, call))
+        self._hedged_attempt(f, args, kwargs, first_node, race, 0, call)
+        # the losing request is aborted by race.finish, its connection is shut down
+        attempt, success, value = race.result()
+        self.hedging.record(time.time() - start, hedge_fired=race.fired,
+                            hedge_won=(success and attempt == 1))
+        if not success:
+            raise value
+        return value
+
+    def _connection_error(self, ce):
+        self.logger.exception(ce)
+        return pbx_errors.ConnectionError('Unable to connect to "%s"' % self.url)
 
     @property
     def connected(self):
-        return not(self.session is None)
+        return self._connected
 
     def _check_connection(self):
         if not self.connected:
             raise pbx_errors.ConnectionClosedError('Connection closed')
+        self._check_fork()
 
-    def _build_url(self, database, item=None):
-        url = '/'.join([self.url, database])
-        if item:
-            url = '/'.join([url, item])
-        return url
+    def _request(self, method, database=None, item=None, read=False, session=None, **kwargs):
+        # writes go to the primary node, reads are moved to the next healthy node if the
+        # selected one can't be reached; unreachable nodes are ejected from the pool
+        session = session or getattr(self._local, 'session', None) or self.session
+        pinned_node = getattr(self._local, 'node', None) if read else None
+        tried = list()
+        while True:
+            if pinned_node and len(tried) == 0:
+                node = pinned_node
+            else:
+                node = self.nodes.select(read, exclude=tried)
+            self.nodes.acquire(node)
+            start = time.time()
+            reset_request_sent()
+            try:
+                response = self.transport.request(session, method, node, database, item, **kwargs)
+                self._record_response(response, start, kwargs.get('data'), kwargs.get('stream'))
+                return response
+            except requests.ConnectionError:
+                attempt = current_attempt()
+                if attempt is not None and attempt.aborted:
+                    # shut down by the other attempt of a hedged call, the node is fine
+                    raise
+                self.logger.warning('Unable to connect to node "%s", ejecting it', node)
+                self.nodes.eject(node)
+                tried.append(node)
+                if self.nodes.select(read, exclude=tried) is None:
+                    raise
+                if getattr(self._local, 'call', None) is not None:
+                    self._local.call.add_retry()
+            finally:
+                self.nodes.release(node)
 
     def _resolve_database(self, database_name=None):
         db = database_name or self.default_database
@@ -79,11 +475,40 @@ class BaseXClient(object):
         raise pbx_errors.InvalidURLError(msg)
 
     def _check_url(self, database):
-        # check for invalid BaseX URL
-        _ = self.get_databases()
+        if self._catalog_lookup(database) is not False:
+            # check for invalid BaseX URL (the catalog is refreshed)
+            _ = self.get_databases()
         # URL is a valid one, database does not exist
+        self._catalog_discard(database)
         raise pbx_errors.UnknownDatabaseError('Database "%s" does not exist' % database)
 
+    # --- databases catalog
+    def _update_catalog(self, databases):
+        if self.catalog_ttl is not None:
+            self._catalog = set(databases)
+            self._catalog_expires = time.time() + self.catalog_ttl
+
+    def _catalog_lookup(self, database):
+        # True or False if the catalog is fresh, None if it must be refreshed
+        if self._catalog is None or self._catalog_expires <= time.time():
+            return None
+        return database in self._catalog
+
+    def _catalog_add(self, database):
+        if self._catalog is not None:
+            self._catalog.add(database)
+
+    def _catalog_discard(self, database):
+        if self._catalog is not None:
+            self._catalog.discard(database)
+
+    def _database_listed(self, database):
+        # the catalog is trusted only when it lists the database: a database missing from a
+        # stale catalog could have been created by someone else (i.e. it must not be replaced)
+        if self._catalog_lookup(database):
+            return True
+        return database in self.get_databases()
+
     def _check_response_code(self, response, not_found_callback=None, not_found_params=None,
                              bad_request_excp=None, bad_request_msg=None):
         if response.status_code == requests.codes.unauthorized:
@@ -103,54 +528,197 @@ class BaseXClient(object):
         if not response_xml.tag.startswith('{http://basex.org/rest}database'):
             self._handle_wrong_url()
 
-    def _wrap_results(self, res_text):
-        res_text = '<results>{0}</results>'.format(res_text)
-        return pbx_xml_utils.str_to_xml(res_text)
+    def _post_query(self, q_frag, database, session=None, stream=False, read=False,
+                    bad_request_msg='Query error: ', timeout=None):
+        response = self._check_response_code(
+            response=self._request('POST', database, read=read, session=session,
+                                   data=pbx_xml_utils.xml_to_str(q_frag), stream=stream,
+                                   timeout=timeout),
+            not_found_callback=self._check_url,
+            not_found_params=(database,),
+            bad_request_excp=pbx_errors.QueryError,
+            bad_request_msg=bad_request_msg
+        )
+        return response
+
+    def _wrap_results(self, res_content):
+        with self._timed('parse'):
+            return pbx_xml_utils.wrapped_bytes_to_xml(res_content)
 
-    def _rollback(self, doc_ids, database=None):
-        for d_id in doc_ids:
-            self.delete_document(d_id, database)
+    def _decode_results(self, res_content, result_format, wrapped=True):
+        # xml: a lxml tree (results are wrapped if more than one item is expected),
+        # raw: bytes as returned by BaseX, json: decoded JSON serialization
+        if result_format == 'raw':
+            return res_content
+        if result_format == 'json':
+            if not res_content.strip():
+                return None
+            with self._timed('parse'):
+                return pbx_utils.json_loads(res_content)
+        if wrapped:
+            return self._wrap_results(res_content)
+        return self._parse_response(res_content)
+
+    def _start_workers(self, max_workers, call=None):
+        # a pool of max_workers threads, each one using its own session (local.session)
+        local = threading.local()
+        sessions = list()
+        sessions_lock = threading.Lock()
+        call = call or getattr(self._local, 'call', None)
+
+        def init_worker():
+            # requests performed by the workers are accounted to the calling method
+            self._local.call = call
+            local.session = self._new_session()
+            with sessions_lock:
+                sessions.append(local.session)
+
+        return ThreadPool(max_workers, init_worker), local, sessions
+
+    def _stop_workers(self, pool, sessions):
+        pool.close()
+        pool.join()
+        for s in sessions:
+            s.close()
+
+    def _run_parallel(self, func, items, max_workers, stop_on_error=True):
+        # run func(item, session) for each item on a pool of max_workers threads, each one
+        # using its own session; returns the results of the successful calls and the errors
+        failed = threading.Event()
+        pool, local, sessions = self._start_workers(max_workers)
+
+        def run(item):
+            if stop_on_error and failed.is_set():
+                return False, None
+            try:
+                return True, func(item, local.session)
+            except Exception, e:
+                failed.set()
+                return False, e
+
+        try:
+            outcomes = pool.map(run, items)
+        finally:
+            self._stop_workers(pool, sessions)
+        results = [res for success, res in outcomes if success]
+        errors = [err for success, err in outcomes if not success and err is not None]
+        return results, errors
+
+    def _rollback(self, doc_ids, database=None, max_workers=None, chunk_size=None):
+        if chunk_size:
+            for chunk in pbx_utils.chunks(doc_ids, chunk_size):
+                self._bulk_update([('delete', d_id, None) for d_id in chunk], database)
+        elif max_workers and max_workers > 1:
+            _, errors = self._run_parallel(
+                lambda d_id, session: self._delete_document(d_id, database, session),
+                doc_ids, max_workers, stop_on_error=False
+            )
+            if len(errors) > 0:
+                raise errors[0]
+        else:
+            for d_id in doc_ids:
+                self.delete_document(d_id, database)
 
     def _get_document_id(self):
         return uuid4().hex
 
+    def _known_ids(self, database):
+        if database not in self._ids_index:
+            self._ids_index[database] = set(self.get_resources(database).keys())
+        return self._ids_index[database]
+
+    def _update_ids_index(self, database, added=(), removed=()):
+        if self.track_ids and database in self._ids_index:
+            self._ids_index[database].update(added)
+            self._ids_index[database].difference_update(removed)
+
+    def _notify_write(self, database):
+        if self.query_cache is not None:
+            self.query_cache.invalidate(database)
+
+    def _document_exists(self, document_id, database):
+        if self.track_ids:
+            return document_id in self._known_ids(database)
+        response = self._post_query(build_exists_fragment(database, document_id), database,
+                                    read=True)
+        return response.content.strip() == 'true'
+
     # --- objects creation methods
     @errors_handler
     def create_database(self, database=None):
         db = self._resolve_database(database)
         self.logger.debug('Creating database "%s"' % db)
-        if db not in self.get_databases():
+        if not self._database_listed(db):
             response = self._check_response_code(
-                response=self.session.put(self._build_url(db)),
+                response=self._request('PUT', db),
                 not_found_callback=self._handle_wrong_url
             )
         else:
             raise pbx_errors.OverwriteError('Database "%s" already exists' % db)
+        self._catalog_add(db)
+        if self.track_ids:
+            self._ids_index[db] = set()
+        self._notify_write(db)
         self.logger.info('RESPONSE (status code %d): %s', response.status_code, response.text)
 
-    def _save_document(self, xml_doc, document_id, database):
+    def _save_document(self, xml_doc, document_id, database, session=None):
         response = self._check_response_code(
-            response=self.session.put(
-                self._build_url(database, document_id), xml_doc
-            )
+            response=self._request('PUT', database, document_id, session=session, data=xml_doc)
         )
         return response
 
+    def _save_documents_parallel(self, documents, database, max_workers):
+        def save(item, session):
+            doc_id, doc = item
+            response = self._save_document(pbx_xml_utils.xml_to_str(doc), doc_id, database, session)
+            self.logger.debug('RESPONSE (status code %d): %s', response.status_code, response.text)
+            return doc_id
+        return self._run_parallel(save, documents.iteritems(), max_workers)
+
+    def _bulk_update(self, updates, database, session=None):
+        return self._post_query(build_update_fragment(database, updates), database, session,
+                                bad_request_msg='Update error: ')
+
+    def _save_documents_bulk(self, documents, database, chunk_size, max_workers=None):
+        # every chunk is saved by a single updating query, so it is committed atomically
+        def save(chunk, session):
+            updates = [('add', doc_id, pbx_xml_utils.xml_to_unicode(doc)) for doc_id, doc in chunk]
+            response = self._bulk_update(updates, database, session)
+            self.logger.debug('RESPONSE (status code %d): %s', response.status_code, response.text)
+            return [doc_id for doc_id, _ in chunk]
+        chunks = pbx_utils.chunks(documents.iteritems(), chunk_size)
+        if max_workers and max_workers > 1:
+            results, errors = self._run_parallel(save, chunks, max_workers)
+        else:
+            results, errors = list(), list()
+            for chunk in chunks:
+                try:
+                    results.append(save(chunk, self.session))
+                except Exception, e:
+                    errors.append(e)
+                    break
+        return [doc_id for ids in results for doc_id in ids], errors
+
     @errors_handler
     def add_document(self, xml_doc, document_id=None, database=None):
-        document_id = document_id or self._get_document_id()
         db = self._resolve_database(database)
-        if document_id in self.get_resources(db):
+        if document_id is None:
+            # a freshly generated ID can't be already in use, skip the check
+            document_id = self._get_document_id()
+        elif self._document_exists(document_id, db):
             raise pbx_errors.OverwriteError('A document with ID "%s" already exists in database "%s"' %
                                             (document_id, db))
         xml_doc = pbx_xml_utils.xml_to_str(xml_doc)
         self.logger.debug('Saving document %s' % xml_doc)
         response = self._save_document(xml_doc, document_id, db)
+        self._update_ids_index(db, added=(document_id,))
+        self._notify_write(db)
         self.logger.info('RESPONSE (status code %d): %s', response.status_code, response.text)
         return document_id
 
     @errors_handler
-    def add_documents(self, documents, database=None, skip_duplicated=False):
+    def add_documents(self, documents, database=None, skip_duplicated=False, max_workers=None,
+                      chunk_size=None):
         db = self._resolve_database(database)
         saved_ids = list()
         duplicated_ids = list()
@@ -160,7 +728,7 @@ class BaseXClient(object):
             pass
         else:
             raise TypeError('%s is not a valid type for "documents" field' % type(documents))
-        known_ids = self.get_resources(db)
+        known_ids = self._known_ids(db) if self.track_ids else self.get_resources(db)
         for doc_id in documents.keys():
             if doc_id in known_ids:
                 duplicated_ids.append(doc_id)
@@ -173,26 +741,219 @@ class BaseXClient(object):
                                                 (duplicated_ids, db))
         self.logger.info('Saving %d documents to database %s', len(documents), db)
         try:
-            for doc_id, doc in documents.iteritems():
-                response = self._save_document(pbx_xml_utils.xml_to_str(doc), doc_id, db)
-                saved_ids.append(doc_id)
-                self.logger.debug('RESPONSE (status code %d): %s', response.status_code, response.text)
+            if chunk_size or (max_workers and max_workers > 1):
+                if chunk_size:
+                    ids, errors = self._save_documents_bulk(documents, db, chunk_size, max_workers)
+                else:
+                    ids, errors = self._save_documents_parallel(documents, db, max_workers)
+                saved_ids.extend(ids)
+                if len(errors) > 0:
+                    raise errors[0]
+            else:
+                for doc_id, doc in documents.iteritems():
+                    response = self._save_document(pbx_xml_utils.xml_to_str(doc), doc_id, db)
+                    saved_ids.append(doc_id)
+                    self.logger.debug('RESPONSE (status code %d): %s', response.status_code, response.text)
         except Exception, e:
             self.logger.critical('An error occurred, performing rollback')
-            self._rollback(saved_ids, db)
+            self._rollback(saved_ids, db, max_workers, chunk_size)
             raise e
+        finally:
+            self._notify_write(db)
+        self._update_ids_index(db, added=saved_ids)
         self.logger.info('%d documents saved, %d duplicated found',
                          len(saved_ids), len(duplicated_ids))
         return saved_ids, duplicated_ids
 
+    def _read_document(self, path):
+        # files are decoded as stated by their XML declaration, never parsed
+        with open(path, 'rb') as f:
+            return pbx_xml_utils.decode_xml_bytes(f.read())
+
+    def _ingest_item(self, item):
+        # returns (document ID, serialized document): strings starting with "<" are XML
+        # documents, any other string is a file path
+        document_id = None
+        if isinstance(item, tuple):
+            document_id, item = item
+        if isinstance(item, etree._Element):
+            content = pbx_xml_utils.xml_to_unicode(item)
+        elif isinstance(item, unicode) and pbx_xml_utils.is_xml_string(item):
+            content = item
+        elif isinstance(item, str) and pbx_xml_utils.is_xml_string(item):
+            content = pbx_xml_utils.decode_xml_bytes(item)
+        elif isinstance(item, basestring):
+            document_id = document_id or os.path.basename(item)
+            content = self._read_document(item)
+        else:
+            raise TypeError('%s is not a valid type for a document to ingest' % type(item))
+        return document_id or self._get_document_id(), content
+
+    @errors_handler
+    def ingest(self, source, chunk_size=None, database=None, progress=None):
+        # source is a directory (every INGEST_EXTENSIONS file is loaded, the relative path
+        # is the document ID), a file path or an iterable of lxml elements, XML strings,
+        # file paths or (document ID, document) tuples; only chunk_size documents are kept
+        # in memory and each chunk is saved by a single updating query. Existing documents
+        # with the same ID are replaced. progress, if given, is called after each chunk
+        # with the number of documents ingested so far and the IDs of the chunk
+        db = self._resolve_database(database)
+        if isinstance(source, basestring) and os.path.isdir(source):
+            documents = ((doc_id, self._read_document(path))
+                         for doc_id, path in pbx_utils.iter_files(source, self.INGEST_EXTENSIONS))
+        else:
+            if isinstance(source, basestring):
+                source = [source]
+            documents = (self._ingest_item(item) for item in source)
+        ingested = 0
+        for chunk in pbx_utils.chunks(documents, chunk_size or self.INGEST_CHUNK_SIZE):
+            try:
+                self._bulk_update([('replace', doc_id, doc) for doc_id, doc in chunk], db)
+            finally:
+                self._notify_write(db)
+            ids = [doc_id for doc_id, _ in chunk]
+            ingested += len(ids)
+            self._update_ids_index(db, added=ids)
+            self.logger.info('%d documents ingested into database %s', ingested, db)
+            if progress:
+                progress(ingested, ids)
+        return ingested
+
+    def _sync_item(self, document_id, document):
+        # returns (serialized document, hash of its canonical form)
+        document_id, content = self._ingest_item((document_id, document))
+        if isinstance(document, etree._Element):
+            xml_doc = document
+        else:
+            xml_doc = pbx_xml_utils.bytes_to_xml(content.encode('utf-8'))
+        return content, document_hash(xml_doc)
+
+    def _sync_chunks(self, updates, database, manifest, chunk_size):
+        # updates are (action, document ID, document, hash) tuples, the manifest is updated
+        # and saved after each chunk so that an interrupted sync is resumed where it stopped
+        for chunk in pbx_utils.chunks(updates, chunk_size):
+            try:
+                self._bulk_update([(action, doc_id, doc) for action, doc_id, doc, _ in chunk],
+                                  database)
+            finally:
+                self._notify_write(database)
+            for action, doc_id, _, digest in chunk:
+                if action == 'delete':
+                    manifest.discard(database, doc_id)
+                else:
+                    manifest.set(database, doc_id, digest)
+            manifest.save()
+            self._update_ids_index(
+                database,
+                added=[doc_id for action, doc_id, _, _ in chunk if action != 'delete'],
+                removed=[doc_id for action, doc_id, _, _ in chunk if action == 'delete']
+            )
+            yield chunk
+
+    @errors_handler
+    def sync_documents(self, documents, database=None, manifest=None, delete_missing=False,
+                       chunk_size=None):
+        # documents is a dict or an iterable of (document ID, document) tuples, documents are
+        # lxml elements, XML strings or file paths. manifest is a sync.SyncManifest or the
+        # path of its file (kept in memory if None): a document is uploaded only if it is
+        # not in the manifest, its canonical form has a different hash or its size listed by
+        # BaseX does not match the recorded one (i.e. it was changed by someone else).
+        # With delete_missing the documents of the database not in documents are deleted.
+        # Returns a dict with the uploaded and deleted IDs and the number of unchanged ones
+        db = self._resolve_database(database)
+        if not isinstance(manifest, SyncManifest):
+            manifest = SyncManifest(manifest)
+        if isinstance(documents, dict):
+            documents = documents.iteritems()
+        resources = self.get_resources(db)
+        seen = set()
+        summary = {'uploaded': list(), 'deleted': list(), 'unchanged': 0}
+
+        def uploads():
+            for doc_id, doc in documents:
+                seen.add(doc_id)
+                content, digest = self._sync_item(doc_id, doc)
+                entry = manifest.get(db, doc_id)
+                size = resources[doc_id]['size'] if doc_id in resources else None
+                if entry and doc_id in resources and entry[0] == digest and entry[1] in (None, size):
+                    # sizes of the uploaded documents are recorded by the next sync
+                    summary['unchanged'] += 1
+                    manifest.set(db, doc_id, digest, size)
+                    continue
+                yield 'replace', doc_id, content, digest
+
+        chunk_size = chunk_size or self.INGEST_CHUNK_SIZE
+        for chunk in self._sync_chunks(uploads(), db, manifest, chunk_size):
+            summary['uploaded'].extend(doc_id for _, doc_id, _, _ in chunk)
+        for doc_id in manifest.documents(db).keys():
+            if doc_id not in seen and doc_id not in resources:
+                manifest.discard(db, doc_id)
+        if delete_missing:
+            deletes = [('delete', doc_id, None, None) for doc_id in sorted(resources)
+                       if doc_id not in seen]
+            for chunk in self._sync_chunks(deletes, db, manifest, chunk_size):
+                summary['deleted'].extend(doc_id for _, doc_id, _, _ in chunk)
+        manifest.save()
+        self.logger.info('%d documents uploaded to database %s, %d deleted, %d unchanged',
+                         len(summary['uploaded']), db, len(summary['deleted']), summary['unchanged'])
+        return summary
+
+    def buffered_writer(self, database=None, max_documents=100, max_bytes=1024 * 1024,
+                        flush_interval=1.0, max_pending=None, on_error=None):
+        # see writer.BufferedWriter, close it (or use it as a context manager) to write
+        # the buffered operations
+        self._check_connection()
+        return BufferedWriter(self, self._resolve_database(database), max_documents, max_bytes,
+                              flush_interval, max_pending, on_error)
+
+    def _resource_id(self, source):
+        name = source if isinstance(source, basestring) else getattr(source, 'name', None)
+        if isinstance(name, basestring):
+            return os.path.basename(name)
+        return self._get_document_id()
+
+    def _store_resource(self, body, document_id, database, content_type):
+        response = self._check_response_code(
+            response=self._request('PUT', database, document_id, data=body,
+                                   content_type=content_type),
+            not_found_callback=self._check_url,
+            not_found_params=(database,)
+        )
+        return response
+
+    @errors_handler
+    def store_resource(self, source, document_id=None, database=None, content_type='application/xml'):
+        # source is a file path, a file object (or a mmap) or an iterable of byte strings, the
+        # request body is streamed (chunked if its size is unknown) and never held in memory;
+        # a non XML content_type (i.e. RAW_CONTENT_TYPE) stores a raw resource. Existing
+        # resources with the same ID are replaced
+        db = self._resolve_database(database)
+        document_id = document_id or self._resource_id(source)
+        if isinstance(source, basestring):
+            with open(source, 'rb') as f:
+                response = self._store_resource(f, document_id, db, content_type)
+        else:
+            response = self._store_resource(source, document_id, db, content_type)
+        self._update_ids_index(db, added=(document_id,))
+        self._notify_write(db)
+        self.logger.info('RESPONSE (status code %d): %s', response.status_code, response.text)
+        return document_id
+
     # --- objects retrieval methods
     @errors_handler
+    @read_only
+    def document_exists(self, document_id, database=None):
+        db = self._resolve_database(database)
+        return self._document_exists(document_id, db)
+
+    @errors_handler
+    @read_only
     def get_databases(self):
         response = self._check_response_code(
-            response=self.session.get(self.url),
+            response=self._request('GET', read=True),
             not_found_callback=self._handle_wrong_url
         )
-        results = pbx_xml_utils.str_to_xml(response.text)
+        results = self._parse_response(response.content)
         self._check_response_tag(results)
         dbs_map = {}
         for ch in results.getchildren():
@@ -200,17 +961,30 @@ class BaseXClient(object):
                 'size': ch.get('size'),
                 'resources': ch.get('resources')
             }
+        self._update_catalog(dbs_map.keys())
         return dbs_map
 
     @errors_handler
+    @read_only
+    def database_exists(self, database=None):
+        # answered by the catalog, if enabled and fresh
+        db = self._resolve_database(database)
+        return self._database_listed(db)
+
+    @errors_handler
+    def refresh_catalog(self):
+        return set(self.get_databases().keys())
+
+    @errors_handler
+    @read_only
     def get_resources(self, database=None):
         db = self._resolve_database(database)
         response = self._check_response_code(
-            response=self.session.get(self._build_url(db)),
+            response=self._request('GET', db, read=True),
             not_found_callback=self._check_url,
             not_found_params=(db,)
         )
-        results = pbx_xml_utils.str_to_xml(response.text)
+        results = self._parse_response(response.content)
         self._check_response_tag(results)
         res_map = {}
         for ch in results.getchildren():
@@ -222,57 +996,430 @@ class BaseXClient(object):
         return res_map
 
     @errors_handler
-    def get_document(self, document_id, database=None):
+    @read_only
+    def get_document(self, document_id, database=None, result_format='xml'):
         db = self._resolve_database(database)
+        if result_format != 'xml':
+            return self._query_document(document_id, db, result_format)
         response = self._check_response_code(
-            response=self.session.get(self._build_url(db, document_id)),
+            response=self._request('GET', db, document_id, read=True),
             not_found_callback=self._check_url,
             not_found_params=(db,)
         )
-        result = pbx_xml_utils.str_to_xml(response.text)
+        result = self._parse_response(response.content)
         if result.tag.startswith('{http://basex.org/rest}database') and int(result.get('resources')) == 0:
             self.logger.info('There is not document with ID "%s" in database "%s"' % (document_id, db))
             return None
         else:
             return result
 
+    def _query_document(self, document_id, database, result_format):
+        response = self._post_query(
+            build_document_fragment(database, document_id, serialization_parameters(result_format)),
+            database, read=True
+        )
+        if not response.content:
+            self.logger.info('There is not document with ID "%s" in database "%s"' % (document_id, database))
+            return None
+        return self._decode_results(response.content, result_format, wrapped=False)
+
+    def _is_resource_head(self, head):
+        # BaseX answers with an empty listing of the database (a single empty element) if
+        # there is no such resource: True once head is enough to tell it apart
+        if len(head) < len(self.EMPTY_LISTING_PREFIX):
+            return not self.EMPTY_LISTING_PREFIX.startswith(head)
+        return not head.startswith(self.EMPTY_LISTING_PREFIX) or '>' in head
+
+    def _is_missing_resource(self, head):
+        if not head.startswith(self.EMPTY_LISTING_PREFIX):
+            return False
+        try:
+            result = self._parse_response(head)
+        except etree.XMLSyntaxError:
+            return False
+        return result.tag == '{http://basex.org/rest}database' and result.get('resources') == '0'
+
+    def _write_resource(self, chunks, dest):
+        # chunks are buffered until it is known whether the resource exists
+        chunks = iter(chunks)
+        head = ''
+        for chunk in chunks:
+            head += chunk
+            if self._is_resource_head(head):
+                break
+        if self._is_missing_resource(head):
+            return None
+        # the destination file is created only if the resource exists
+        f = open(dest, 'wb') if isinstance(dest, basestring) else dest
+        written = 0
+        try:
+            f.write(head)
+            written += len(head)
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+        finally:
+            if f is not dest:
+                f.close()
+        return written
+
+    def _fetch_resource(self, document_id, database, chunk_size):
+        response = self._check_response_code(
+            response=self._request('GET', database, document_id, read=True, stream=True),
+            not_found_callback=self._check_url,
+            not_found_params=(database,)
+        )
+        return response, self._iter_content(response, chunk_size)
+
+    @errors_handler
+    def fetch_resource(self, document_id, dest, database=None, chunk_size=None):
+        # dest is a file path or a writable file object, the resource is written chunk_size
+        # bytes at a time; returns the number of written bytes, None if there is no such resource
+        db = self._resolve_database(database)
+        response, chunks = self._fetch_resource(document_id, db, chunk_size or self.STREAM_CHUNK_SIZE)
+        try:
+            written = self._write_resource(chunks, dest)
+        finally:
+            response.close()
+        if written is None:
+            self.logger.info('There is not resource with ID "%s" in database "%s"' % (document_id, db))
+        return written
+
+    def _iter_wrapped_documents(self, response):
+        # documents are returned as <document path="...">document</document> items
+        for wrapper in self._iter_response_items(response):
+            doc = next(wrapper.iterchildren(tag=etree.Element), None)
+            if doc is not None:
+                wrapper.remove(doc)
+            yield wrapper.get('path'), doc
+
+    def _iter_documents(self, database, batch_size):
+        # documents are fetched batch_size at a time, one query for each batch
+        start = 1
+        while True:
+            try:
+                response = self._post_query(build_documents_fragment(database, start, batch_size),
+                                            database, stream=True, read=True)
+            except requests.ConnectionError, ce:
+                raise self._connection_error(ce)
+            count = 0
+            for path, doc in self._iter_wrapped_documents(response):
+                count += 1
+                yield path, doc
+            if count < batch_size:
+                break
+            start += batch_size
+
+    def _iter_serialized_documents(self, database, batch_size, result_format):
+        # documents serialized by BaseX are the text of <document path="..."> items
+        method = serialization_parameters(result_format).get('method', 'xml')
+        start = 1
+        while True:
+            try:
+                response = self._post_query(
+                    build_serialized_documents_fragment(database, start, batch_size, method),
+                    database, stream=True, read=True
+                )
+            except requests.ConnectionError, ce:
+                raise self._connection_error(ce)
+            count = 0
+            for wrapper in self._iter_response_items(response):
+                count += 1
+                if result_format == 'json':
+                    with self._timed('parse'):
+                        doc = pbx_utils.json_loads(wrapper.text)
+                else:
+                    doc = (wrapper.text or '').encode('utf-8')
+                yield wrapper.get('path'), doc
+            if count < batch_size:
+                break
+            start += batch_size
+
+    def _fetch_documents(self, document_ids, database):
+        # a single query for all the documents, missing IDs are not in the returned dict
+        try:
+            response = self._post_query(build_documents_by_path_fragment(database, document_ids),
+                                        database, stream=True, read=True)
+        except requests.ConnectionError, ce:
+            raise self._connection_error(ce)
+        return dict(self._iter_wrapped_documents(response))
+
     @errors_handler
-    def get_documents(self, database=None):
+    def iter_documents(self, database=None, batch_size=None, result_format='xml'):
         db = self._resolve_database(database)
-        res = self.get_resources(db)
-        docs = {doc_id: self.get_document(doc_id, db) for doc_id in res.keys()}
-        return docs
+        if result_format != 'xml':
+            serialization_parameters(result_format)
+            return self._iter_serialized_documents(db, batch_size or self.DOCUMENTS_BATCH_SIZE,
+                                                   result_format)
+        return self._iter_documents(db, batch_size or self.DOCUMENTS_BATCH_SIZE)
+
+    @errors_handler
+    def get_documents(self, database=None, batch_size=None, result_format='xml'):
+        db = self._resolve_database(database)
+        if result_format != 'xml':
+            return dict(self._iter_serialized_documents(db, batch_size or self.DOCUMENTS_BATCH_SIZE,
+                                                        result_format))
+        return dict(self._iter_documents(db, batch_size or self.DOCUMENTS_BATCH_SIZE))
+
+    @errors_handler
+    def documents(self, database=None, cache_size=128, prefetch=0):
+        # see documents.LazyDocuments, only the list of the resources is retrieved here
+        db = self._resolve_database(database)
+        return LazyDocuments(self, db, cache_size, prefetch)
 
     # --- objects deletion methods
     @errors_handler
     def delete_database(self, database=None):
         db = self._resolve_database(database)
         response = self._check_response_code(
-            response=self.session.delete(self._build_url(db)),
+            response=self._request('DELETE', db),
             not_found_callback=self._check_url,
             not_found_params=(db,)
         )
+        self._catalog_discard(db)
+        self._ids_index.pop(db, None)
+        self._notify_write(db)
 
-    @errors_handler
-    def delete_document(self, document_id, database=None):
-        db = self._resolve_database(database)
+    def _delete_document(self, document_id, database, session=None):
         response = self._check_response_code(
-            response=self.session.delete(self._build_url(db, document_id)),
+            response=self._request('DELETE', database, document_id, session=session),
             not_found_callback=self._check_url,
-            not_found_params=(db,)
+            not_found_params=(database,)
         )
+        return response
+
+    @errors_handler
+    def delete_document(self, document_id, database=None):
+        db = self._resolve_database(database)
+        self._delete_document(document_id, db)
+        self._update_ids_index(db, removed=(document_id,))
+        self._notify_write(db)
 
     # --- commands\queries execution methods
     @errors_handler
-    def execute_query(self, query, database=None):
+    @read_only_if('hedge')
+    def execute_query(self, query, database=None, variables=None, result_format='xml', cache=True,
+                      hedge=False, primary=False):
+        # result_format is one of fragments.RESULT_FORMATS: the JSON serialization of the
+        # results requires a single result item (a <json> element, see RESULT_FORMATS).
+        # XQuery Update expressions must be executed with cache=False and primary=True: their
+        # results are not cached, the cached results of the database are invalidated and the
+        # query is sent to the primary node, not to a replica. Queries could be updating
+        # ones, so they are hedged (see hedging) only with hedge=True
         db = self._resolve_database(database)
-        q_frag = build_query_fragment(query)
-        response = self._check_response_code(
-            response=self.session.post(self._build_url(db),
-                                       pbx_utils.xml_utils.xml_to_str(q_frag)),
-            not_found_callback=self._check_url,
-            not_found_params=(db,),
-            bad_request_excp=pbx_errors.QueryError,
-            bad_request_msg='Query error: '
-        )
-        return self._wrap_results(response.text)
+        variables = variables_dict(variables)
+        parameters = serialization_parameters(result_format)
+        read = not primary
+        if not cache:
+            try:
+                response = self._post_query(build_query_fragment(query, variables, parameters), db,
+                                            read=read)
+            finally:
+                self._notify_write(db)
+            return self._decode_results(response.content, result_format)
+        if self.query_cache is not None:
+            cache_key = self.query_cache.build_key(db, query, variables, result_format)
+            results = self.query_cache.get(cache_key)
+            if results is None:
+                response = self._post_query(build_query_fragment(query, variables, parameters), db,
+                                            read=read)
+                results = self._decode_results(response.content, result_format)
+                self.query_cache.set(cache_key, results)
+            # cached trees are never handed out, callers could modify them
+            return results if result_format == 'raw' else deepcopy(results)
+        response = self._post_query(build_query_fragment(query, variables, parameters), db, read=read)
+        return self._decode_results(response.content, result_format)
+
+    def _split_batch_results(self, res_content, count):
+        # one result tree (as returned by execute_query) or QueryError for each query
+        results = [None] * count
+        for envelope in list(self._wrap_results(res_content)):
+            index = int(envelope.get('index'))
+            if envelope.tag == BATCH_ERROR_TAG:
+                results[index] = pbx_errors.QueryError('Query error: [%s] %s' %
+                                                       (envelope.get('code'), envelope.text or ''))
+            else:
+                envelope.getparent().remove(envelope)
+                envelope.tag = 'results'
+                del envelope.attrib['index']
+                results[index] = envelope
+        return [r if r is not None else pbx_errors.QueryError('Query error: no results returned')
+                for r in results]
+
+    def _execute_batch(self, queries, database, variables):
+        q_frag = build_query_fragment(build_batch_query(queries, variables), variables)
+        response = self._post_query(q_frag, database, read=True)
+        return self._split_batch_results(response.content, len(queries))
+
+    def _execute_queries(self, queries, database, variables):
+        try:
+            return self._execute_batch(queries, database, variables)
+        except pbx_errors.QueryError, qe:
+            if len(queries) == 1:
+                return [qe]
+            # a static error (e.g. a syntax error) fails the whole batch, find the guilty query
+            self.logger.warning('Unable to execute a batch of %d queries (%s), '
+                                'executing them one by one', len(queries), qe)
+            results = list()
+            for query in queries:
+                results.extend(self._execute_queries([query], database, variables))
+            return results
+
+    @errors_handler
+    @read_only
+    def execute_queries(self, queries, database=None, variables=None):
+        # queries are plain expressions (no prolog) executed with a single request, variables
+        # are shared by all of them; returns a list with the results of each query (as
+        # returned by execute_query) or the QueryError it raised, errors don't stop the others
+        db = self._resolve_database(database)
+        variables = variables_dict(variables)
+        queries = list(queries)
+        results = [None] * len(queries)
+        if self.query_cache is not None:
+            cache_keys = [self.query_cache.build_key(db, q, variables) for q in queries]
+            for i, key in enumerate(cache_keys):
+                results[i] = self.query_cache.get(key)
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            executed = self._execute_queries([queries[i] for i in missing], db, variables)
+            for i, r in zip(missing, executed):
+                results[i] = r
+                if self.query_cache is not None and not isinstance(r, Exception):
+                    self.query_cache.set(cache_keys[i], r)
+        if self.query_cache is not None:
+            # cached trees are never handed out, callers could modify them
+            results = [r if isinstance(r, Exception) else deepcopy(r) for r in results]
+        return results
+
+    def _fan_out(self, query, databases, concurrency, variables, result_format, timeout):
+        # the query is sent to all the databases at once (concurrency at a time), returns an
+        # iterator of (database, success, results or exception) in order of completion.
+        # Nothing is started (nor recorded, see instrumentation) until the first iteration
+        parameters = serialization_parameters(result_format)
+
+        def run(db, session):
+            try:
+                response = self._post_query(build_query_fragment(query, variables, parameters), db,
+                                            session=session, read=True, timeout=timeout)
+                return db, True, self._decode_results(response.content, result_format)
+            except requests.Timeout:
+                return db, False, pbx_errors.TimeoutError('Query on database "%s" timed out after %ss' %
+                                                          (db, timeout))
+            except requests.ConnectionError, ce:
+                return db, False, self._connection_error(ce)
+            except Exception, e:
+                return db, False, e
+
+        def collect():
+            # the call is not bound to the caller's thread, which runs its own calls while
+            # iterating, only the workers account their requests to it
+            call = None
+            if self.instrumentation is not None:
+                call = CallRecord('execute_query_many')
+                self.instrumentation.call_started(call)
+            pool, local, sessions = self._start_workers(min(concurrency, len(databases)) or 1, call)
+            try:
+                for outcome in pool.imap_unordered(lambda db: run(db, local.session), databases):
+                    yield outcome
+            finally:
+                self._stop_workers(pool, sessions)
+                if call is not None:
+                    call.finish()
+                    self.instrumentation.call_finished(call)
+        return collect()
+
+    def execute_query_many(self, query, databases, concurrency=10, variables=None,
+                           result_format='xml', timeout=None, order_by=None):
+        # see fanout.FanOutResults; failed queries don't stop the others and are reported by
+        # the errors attribute of the returned object. timeout (seconds) is the socket timeout
+        # of the HTTP requests: it applies to connecting and to each read, it is not a limit
+        # on the whole query of a database, which never times out while it keeps sending data
+        # (the socket transport uses its own timeout). Queries are sent when the results are
+        # iterated
+        self._check_connection()
+        if concurrency < 1:
+            raise ValueError('concurrency must be a positive integer')
+        databases = list(databases)
+        outcomes = self._fan_out(query, databases, concurrency, variables, result_format, timeout)
+        return FanOutResults(outcomes, order_by)
+
+    def _iter_response_items(self, response, keep_text=False):
+        try:
+            chunks = self._iter_content(response, self.STREAM_CHUNK_SIZE)
+            for item in pbx_xml_utils.iter_xml_items(chunks, keep_text=keep_text):
+                yield item
+        except requests.ConnectionError, ce:
+            raise self._connection_error(ce)
+        finally:
+            response.close()
+
+    @errors_handler
+    def iter_query(self, query, database=None, variables=None):
+        # yields elements and, as strings, atomic and text items
+        db = self._resolve_database(database)
+        response = self._post_query(build_query_fragment(query, variables), db, stream=True,
+                                    read=True)
+        return self._iter_response_items(response, keep_text=True)
+
+    @staticmethod
+    def _append_text(parent, text):
+        if len(parent):
+            parent[-1].tail = (parent[-1].tail or '') + text
+        else:
+            parent.text = (parent.text or '') + text
+
+    def _unwrap_page(self, wrapped_page):
+        # returns the number of items and the page as returned by execute_query: the
+        # contents of the PAGE_ITEM_TAG wrappers are moved to the page, adjacent atomic
+        # items are separated by a space
+        page = etree.Element(wrapped_page.tag)
+        count = 0
+        previous_atomic = False
+        for wrapper in wrapped_page.iterchildren(PAGE_ITEM_TAG):
+            count += 1
+            children = list(wrapper)
+            atomic = len(children) == 0
+            if wrapper.text:
+                self._append_text(page, (' ' if atomic and previous_atomic else '') + wrapper.text)
+            for child in children:
+                page.append(child)
+            previous_atomic = atomic
+        return count, page
+
+    def _paginate_query(self, query, page_size, database, variables, prefetch):
+        page_query = build_page_query(query, variables)
+        pool = ThreadPool(1) if prefetch else None
+
+        def fetch_page(start):
+            page_vars = dict(variables or {})
+            page_vars.update({'pybasex_start': start, 'pybasex_size': page_size})
+            return self._unwrap_page(self.execute_query(page_query, database, page_vars))
+
+        start = 1
+        next_page = None
+        try:
+            while True:
+                count, page = next_page.get() if next_page else fetch_page(start)
+                start += page_size
+                last_page = count < page_size
+                if prefetch and not last_page:
+                    # fetch the next page while the caller is processing this one
+                    next_page = pool.apply_async(fetch_page, (start,))
+                else:
+                    next_page = None
+                if count > 0:
+                    yield page
+                if last_page:
+                    break
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    @errors_handler
+    def paginate_query(self, query, page_size, database=None, variables=None, prefetch=True):
+        db = self._resolve_database(database)
+        variables = variables_dict(variables)
+        if page_size < 1:
+            raise ValueError('page_size must be a positive integer')
+        return self._paginate_query(query, page_size, db, variables, prefetch)
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+import utils as pbx_utils
+
+
+class LRUCache(pbx_utils.PicklableLockMixin):
+
+    _lock_factory = staticmethod(threading.RLock)
+
+    def __init__(self, max_size=128, ttl=None):
+        if max_size < 1:
+            raise ValueError('max_size must be a positive integer')
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = self._lock_factory()
+
+    def __getstate__(self):
+        # cached values belong to this process (and can't always be pickled), an
+        # unpickled cache starts empty, with the same size and ttl
+        state = super(LRUCache, self).__getstate__()
+        state.update(_items=OrderedDict(), hits=0, misses=0)
+        return state
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def _expiration(self):
+        if self.ttl is None:
+            return None
+        return time.time() + self.ttl
+
+    def get(self, key, default=None, count=True):
+        with self._lock:
+            try:
+                value, expires = self._items.pop(key)
+            except KeyError:
+                value, expires = default, None
+                found = False
+            else:
+                found = expires is None or expires > time.time()
+                if found:
+                    # move the item to the most recently used position
+                    self._items[key] = (value, expires)
+                else:
+                    value = default
+            if count:
+                if found:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, self._expiration())
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class QueryCache(LRUCache):
+
+    @staticmethod
+    def build_key(database, query, variables=None, result_format='xml'):
+        query = query.strip().replace('\r\n', '\n')
+        return database, query, tuple(sorted((variables or {}).items())), result_format
+
+    def invalidate(self, database):
+        with self._lock:
+            for key in [k for k in self._items.keys() if k[0] == database]:
+                del self._items[key]
@@ -0,0 +1,102 @@
+from collections import Mapping
+from multiprocessing.pool import ThreadPool
+
+import utils as pbx_utils
+from cache import LRUCache
+
+
+class LazyDocuments(Mapping):
+    """
+    Read-only mapping of the documents of a database, obtained by BaseXClient.documents:
+    keys are listed once (call refresh() to list them again), documents are retrieved on
+    first access and the last cache_size parsed trees are kept in memory, so that the
+    same tree is returned until it is evicted.
+    With prefetch > 0, iteritems and itervalues retrieve the documents prefetch at a
+    time with a single query for each batch, fetching the next batch in background.
+    """
+
+    def __init__(self, client, database, cache_size=128, prefetch=0):
+        self.client = client
+        self.database = database
+        self.prefetch = prefetch
+        self._cache = LRUCache(cache_size)
+        self._keys = list()
+        self._keys_set = set()
+        self.refresh()
+
+    def refresh(self):
+        self._keys = self.client.get_resources(self.database).keys()
+        self._keys_set = set(self._keys)
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys_set
+
+    def __getitem__(self, key):
+        if key not in self._keys_set:
+            raise KeyError(key)
+        doc = self._cache.get(key)
+        if doc is None:
+            doc = self.client.get_document(key, self.database)
+            if doc is None:
+                # deleted after the keys were listed
+                raise KeyError(key)
+            self._cache.set(key, doc)
+        return doc
+
+    def cache_stats(self):
+        return self._cache.stats()
+
+    def _fetch_batch(self, keys):
+        missing = [k for k in keys if k not in self._cache]
+        docs = self.client._fetch_documents(missing, self.database) if missing else dict()
+        for k in keys:
+            if k not in docs:
+                doc = self._cache.get(k)
+                if doc is not None:
+                    docs[k] = doc
+        return docs
+
+    def iteritems(self):
+        if not self.prefetch:
+            for key in self._keys:
+                try:
+                    yield key, self[key]
+                except KeyError:
+                    pass
+            return
+        pool = ThreadPool(1)
+        try:
+            batches = pbx_utils.chunks(self._keys, self.prefetch)
+            batch = next(batches, None)
+            next_docs = pool.apply_async(self._fetch_batch, (batch,)) if batch else None
+            while batch:
+                docs = next_docs.get()
+                next_batch = next(batches, None)
+                if next_batch:
+                    # fetch the next batch while the caller is processing this one
+                    next_docs = pool.apply_async(self._fetch_batch, (next_batch,))
+                for key in batch:
+                    if key in docs:
+                        self._cache.set(key, docs[key])
+                        yield key, docs[key]
+                batch = next_batch
+        finally:
+            pool.close()
+            pool.join()
+
+    def itervalues(self):
+        for _, doc in self.iteritems():
+            yield doc
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
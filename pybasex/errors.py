@@ -27,4 +27,12 @@ class QueryError(Exception):
 
 
 class AuthenticationError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class CommandError(Exception):
+    pass
+
+
+class TimeoutError(Exception):
+    pass
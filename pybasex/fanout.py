@@ -0,0 +1,47 @@
+from lxml import etree
+
+
+class FanOutResults(object):
+    """
+    Results of BaseXClient.execute_query_many: iterate over it to get (database, item)
+    pairs, items are the elements returned by the query (the whole results, for the raw
+    and json formats). Results of each database are yielded as soon as its query is
+    completed; if order_by is given the items of all the databases are sorted by
+    order_by(item) in a single sequence (cheaper if the query already sorts them): this is
+    not streamed, nothing is yielded until every database has answered.
+    After the iteration, completed lists the databases that answered and errors maps the
+    other ones to the exception raised by their query.
+    """
+
+    def __init__(self, outcomes, order_by=None):
+        self._outcomes = outcomes
+        self.order_by = order_by
+        self.completed = list()
+        self.errors = dict()
+
+    @staticmethod
+    def _items(results):
+        if isinstance(results, etree._Element):
+            return list(results)
+        return [results]
+
+    def _iter_outcomes(self):
+        for database, success, value in self._outcomes:
+            if success:
+                self.completed.append(database)
+                yield database, self._items(value)
+            else:
+                self.errors[database] = value
+
+    def __iter__(self):
+        if self.order_by is None:
+            for database, items in self._iter_outcomes():
+                for item in items:
+                    yield database, item
+            return
+        # the position of the database in the sequence breaks ties, items are never compared
+        results = sorted((self.order_by(item), index, position, database, item)
+                         for index, (database, items) in enumerate(self._iter_outcomes())
+                         for position, item in enumerate(items))
+        for _, _, _, database, item in results:
+            yield database, item
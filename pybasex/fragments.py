@@ -3,13 +3,250 @@ from lxml import etree
 BASEX_XML_NSPACE = 'http://basex.org/rest'
 
 
-def build_query_fragment(query):
+def _variable_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, basestring):
+        return value
+    return str(value)
+
+
+def add_variables(root, variables):
     """
-    <query xmlns="http://basex.org/rest">
-        <text><![CDATA[ (//city/name)[position() <= 5] ]]></text>
-    </query>
+    <variable name="x" value="21"/>
+    <variable name="y" value="21" type="xs:integer"/>
+
+    variables is a dictionary (or a list of pairs) mapping names to values or
+    to (value, XQuery type) tuples
     """
-    root = etree.Element('query', nsmap={None: 'http://basex.org/rest'})
+    if isinstance(variables, dict):
+        variables = variables.iteritems()
+    for name, value in variables:
+        var = etree.SubElement(root, 'variable', name=name)
+        if isinstance(value, tuple):
+            value, var_type = value
+            var.set('type', var_type)
+        var.set('value', _variable_value(value))
+    return root
+
+
+def variables_dict(variables):
+    # variables given as a list of pairs (see add_variables) are turned into a dictionary
+    return dict(variables) if variables else None
+
+
+# serialization parameters sent for each result format of the read methods; BaseX
+# serializes as JSON only documents (or a single result item) following its JSON XML
+# representation, i.e. a <json type="object"> or <json type="array"> element
+RESULT_FORMATS = {
+    'xml': {},
+    'raw': {},
+    'json': {'method': 'json'},
+}
+
+
+def serialization_parameters(result_format):
+    try:
+        return RESULT_FORMATS[result_format]
+    except KeyError:
+        raise ValueError('unsupported result format: %s' % result_format)
+
+
+def add_parameters(root, parameters):
+    """
+    <parameter name="method" value="json"/>
+
+    serialization parameters follow the <text> element
+    """
+    for position, (name, value) in enumerate(sorted(parameters.iteritems())):
+        param = etree.Element('parameter', name=name, value=_variable_value(value))
+        root.insert(1 + position, param)
+    return root
+
+
+def _build_query_base(query):
+    root = etree.Element('query', nsmap={None: BASEX_XML_NSPACE})
     text = etree.SubElement(root, 'text')
     text.text = etree.CDATA(query.strip())
-    return root
\ No newline at end of file
+    return root
+
+
+def build_query_fragment(query, variables=None, parameters=None):
+    """
+    <query xmlns="http://basex.org/rest">
+        <text><![CDATA[ (//city/name)[position() <= $n] ]]></text>
+        <parameter name="method" value="json"/>
+        <variable name="n" value="5" type="xs:integer"/>
+    </query>
+    """
+    root = _build_query_base(query)
+    if parameters:
+        add_parameters(root, parameters)
+    if variables:
+        add_variables(root, variables)
+    return root
+
+
+# db:add doesn't check the path, an existing document would be silently duplicated
+OVERWRITE_ERROR_CODE = 'pybasex:overwrite'
+
+UPDATE_EXPRESSIONS = {
+    'add': 'if (db:exists($db, $p{0})) '
+           'then error(QName("https://github.com/lucalianas/pyBaseX", "%s"), $p{0}) '
+           'else db:add($db, parse-xml($d{0}), $p{0})' % OVERWRITE_ERROR_CODE,
+    'replace': 'db:replace($db, $p{0}, parse-xml($d{0}))',
+    'delete': 'db:delete($db, $p{0})',
+}
+
+
+def build_update_fragment(database, updates):
+    """
+    <query xmlns="http://basex.org/rest">
+        <text><![CDATA[
+            declare variable $db external;
+            declare variable $p0 external;
+            declare variable $d0 external;
+            (db:add($db, parse-xml($d0), $p0))
+        ]]></text>
+        <variable name="db" value="..."/>
+        <variable name="p0" value="..."/>
+        <variable name="d0" value="..."/>
+    </query>
+
+    updates is an iterable of (action, path, document) tuples, action is one of
+    UPDATE_EXPRESSIONS keys and document (a serialized XML string) is None for deletions
+    """
+    prolog = ['declare variable $db external;']
+    expressions = []
+    variables = [('db', database)]
+    for i, (action, path, document) in enumerate(updates):
+        try:
+            expressions.append(UPDATE_EXPRESSIONS[action].format(i))
+        except KeyError:
+            raise ValueError('unsupported update action: %s' % action)
+        prolog.append('declare variable $p%d external;' % i)
+        variables.append(('p%d' % i, path))
+        if document is not None:
+            prolog.append('declare variable $d%d external;' % i)
+            variables.append(('d%d' % i, document))
+    root = _build_query_base('%s\n(%s)' % ('\n'.join(prolog), ',\n'.join(expressions)))
+    return add_variables(root, variables)
+
+
+EXISTS_QUERY = '''
+declare variable $db external;
+declare variable $path external;
+db:exists($db, $path)
+'''
+
+
+def build_exists_fragment(database, path):
+    return build_query_fragment(EXISTS_QUERY, [('db', database), ('path', path)])
+
+
+DOCUMENTS_QUERY = '''
+declare variable $db external;
+declare variable $start external;
+declare variable $size external;
+for $doc in subsequence(db:open($db), xs:integer($start), xs:integer($size))
+return <document path="{db:path($doc)}">{$doc}</document>
+'''
+
+
+def build_documents_fragment(database, start, size):
+    return build_query_fragment(DOCUMENTS_QUERY, [('db', database), ('start', start), ('size', size)])
+
+
+DOCUMENT_QUERY = '''
+declare variable $db external;
+declare variable $path external;
+if (db:exists($db, $path)) then db:open($db, $path) else ()
+'''
+
+
+def build_document_fragment(database, path, parameters=None):
+    return build_query_fragment(DOCUMENT_QUERY, [('db', database), ('path', path)], parameters)
+
+
+# documents are serialized on the server (with the given method) and returned as the text
+# of <document path="..."> items; XQuery 3.0 only (no maps), as supported by BaseX 7.7+
+SERIALIZED_DOCUMENTS_QUERY = '''
+declare namespace output = 'http://www.w3.org/2010/xslt-xquery-serialization';
+declare variable $db external;
+declare variable $start external;
+declare variable $size external;
+declare variable $method external;
+for $doc in subsequence(db:open($db), xs:integer($start), xs:integer($size))
+return <document path="{db:path($doc)}">{
+  serialize($doc, <output:serialization-parameters>
+    <output:method value="{$method}"/>
+  </output:serialization-parameters>)
+}</document>
+'''
+
+
+def build_serialized_documents_fragment(database, start, size, method='xml'):
+    return build_query_fragment(SERIALIZED_DOCUMENTS_QUERY,
+                                [('db', database), ('start', start), ('size', size), ('method', method)])
+
+
+DOCUMENTS_BY_PATH_QUERY = '''
+declare variable $db external;
+declare variable $paths external;
+for $path in tokenize($paths, '&#10;')
+where db:exists($db, $path)
+return <document path="{$path}">{db:open($db, $path)}</document>
+'''
+
+
+def build_documents_by_path_fragment(database, paths):
+    # paths are sent as a single, newline separated, variable
+    return build_query_fragment(DOCUMENTS_BY_PATH_QUERY, [('db', database), ('paths', '\n'.join(paths))])
+
+
+PAGE_ITEM_TAG = 'pybasex-item'
+
+
+def build_page_query(query, variables=None):
+    """
+    declare variable $x external;
+    declare variable $pybasex_start external;
+    declare variable $pybasex_size external;
+    for $pybasex_item in subsequence(( <query> ), xs:integer($pybasex_start), xs:integer($pybasex_size))
+    return <pybasex-item>{ $pybasex_item }</pybasex-item>
+
+    query must be a plain expression (no prolog), external variables are declared
+    here starting from the names in variables; every item is wrapped in a PAGE_ITEM_TAG
+    element, so that atomic and text items can be counted as well
+    """
+    names = sorted(variables or {}) + ['pybasex_start', 'pybasex_size']
+    prolog = ''.join('declare variable $%s external;\n' % n for n in names)
+    return '%sfor $pybasex_item in subsequence((\n%s\n), xs:integer($pybasex_start), ' \
+           'xs:integer($pybasex_size))\nreturn <%s>{ $pybasex_item }</%s>' % \
+           (prolog, query.strip(), PAGE_ITEM_TAG, PAGE_ITEM_TAG)
+
+
+# every query of a batch is evaluated in its own try/catch, results and errors are
+# returned in envelopes tagged with the position of the query
+BATCH_RESULT_TAG = 'pybasex-result'
+BATCH_ERROR_TAG = 'pybasex-error'
+BATCH_ENVELOPE = '''try {{ <pybasex-result index="{0}">{{ (
+{1}
+) }}</pybasex-result> }} catch * {{ <pybasex-error index="{0}" code="{{$err:code}}">{{ $err:description }}</pybasex-error> }}'''
+
+
+def build_batch_query(queries, variables=None):
+    """
+    declare variable $x external;
+    (
+    try { <pybasex-result index="0">{ ( <query> ) }</pybasex-result> }
+    catch * { <pybasex-error index="0" code="{$err:code}">{ $err:description }</pybasex-error> },
+    ...
+    )
+
+    queries must be plain expressions (no prolog), the external variables in variables
+    are declared once and shared by all the queries
+    """
+    prolog = ''.join('declare variable $%s external;\n' % n for n in sorted(variables or {}))
+    return '%s(\n%s\n)' % (prolog, ',\n'.join(BATCH_ENVELOPE.format(i, q.strip())
+                                               for i, q in enumerate(queries)))
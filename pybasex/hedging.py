@@ -0,0 +1,192 @@
+import heapq
+import itertools
+import socket
+import threading
+import time
+from collections import deque
+
+import utils as pbx_utils
+from adapters import set_current_attempt
+
+
+class HedgingPolicy(pbx_utils.PicklableLockMixin):
+    """
+    Configuration and counters of hedged reads: if a read doesn't complete within
+    the given percentile of the recently observed latencies, the same request is sent
+    again to another node (or over another connection) and the first answer wins, the
+    other request is aborted. The first request runs on the calling thread, pool_size
+    is the maximum number of hedges in flight.
+    """
+
+    def __init__(self, percentile=95, min_delay=0.01, max_delay=1.0, window=1000,
+                 min_samples=20, pool_size=8):
+        if not 0 < percentile <= 100:
+            raise ValueError('percentile must be in the (0, 100] range')
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.pool_size = pool_size
+        self.calls = 0
+        self.fired = 0
+        self.won = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency, hedge_fired=False, hedge_won=False):
+        with self._lock:
+            self._latencies.append(latency)
+            self.calls += 1
+            if hedge_fired:
+                self.fired += 1
+            if hedge_won:
+                self.won += 1
+
+    def delay(self):
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.max_delay
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100.0))
+        return min(self.max_delay, max(self.min_delay, latencies[index]))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'fired': self.fired,
+                'won': self.won,
+            }
+
+
+def _shutdown(connection):
+    sock = getattr(connection, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+
+class Attempt(object):
+    """
+    One of the requests racing in a hedged call: it keeps track of the connections
+    used while it is running (see adapters.ClientAdapter and transports.SocketTransport),
+    abort() shuts them down so that the request is interrupted even while waiting for
+    the response.
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self._running = False
+        self._connections = list()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._running = True
+        set_current_attempt(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        set_current_attempt(None)
+        with self._lock:
+            # connections go back to the session pool, they are not ours anymore
+            self._running = False
+            self._connections = list()
+        return None
+
+    def track(self, connection):
+        with self._lock:
+            if not self._running:
+                return
+            if connection not in self._connections:
+                self._connections.append(connection)
+            aborted = self.aborted
+        if aborted:
+            _shutdown(connection)
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            connections = list(self._connections)
+        for connection in connections:
+            _shutdown(connection)
+
+
+class HedgedRace(object):
+    """
+    Outcomes of the two attempts of a hedged call: the first successful one wins and
+    the other one is aborted; if an attempt fails the other one, if fired, is waited for.
+    """
+
+    def __init__(self):
+        self.attempts = (Attempt(), Attempt())
+        self.fired = False
+        self.winner = None
+        self._outcomes = dict()
+        self._cond = threading.Condition()
+
+    def fire(self):
+        # False if the first attempt is already over, the hedge is not needed
+        with self._cond:
+            if 0 in self._outcomes:
+                return False
+            self.fired = True
+            return True
+
+    def finish(self, attempt, success, value):
+        loser = None
+        with self._cond:
+            self._outcomes[attempt] = (success, value)
+            if success and self.winner is None:
+                self.winner = attempt
+                loser = self.attempts[1 - attempt]
+            self._cond.notify_all()
+        if loser is not None:
+            loser.abort()
+
+    def result(self):
+        # (attempt, success, value), called once the first attempt is over
+        with self._cond:
+            while self.winner is None and self.fired and len(self._outcomes) < 2:
+                self._cond.wait()
+            if self.winner is not None:
+                return (self.winner, True, self._outcomes[self.winner][1])
+            return (0, ) + self._outcomes[0]
+
+
+class HedgeScheduler(object):
+    """
+    A single thread firing the hedges when their delay expires: waiting doesn't hold a
+    worker of the hedging pool, only the hedges that are actually sent do.
+    """
+
+    def __init__(self):
+        self._queue = list()
+        self._counter = itertools.count()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def schedule(self, delay, callback):
+        with self._cond:
+            heapq.heappush(self._queue, (time.time() + delay, next(self._counter), callback))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._queue or self._queue[0][0] > time.time()):
+                    self._cond.wait(self._queue[0][0] - time.time() if self._queue else None)
+                if self._closed:
+                    return
+                _, _, callback = heapq.heappop(self._queue)
+            callback()
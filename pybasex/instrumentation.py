@@ -0,0 +1,180 @@
+import bisect
+import threading
+import time
+
+import utils as pbx_utils
+
+# upper bounds of the histograms buckets, the last bucket collects everything above
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+PHASES = ('total', 'request', 'server', 'response', 'parse')
+
+
+class CallRecord(object):
+    """
+    Measures collected during a single BaseXClient method call. Phases are:
+     * request: time spent connecting and sending the requests (headers and body)
+     * server: time between the end of a request and the arrival of the response headers
+     * response: time spent receiving the response bodies
+     * parse: time spent building the XML trees from the responses
+    Methods returning a generator (iter_query, iter_documents...) are recorded when it
+    is exhausted or closed, streamed bodies are measured as they are consumed; total
+    includes the time spent by the caller between the items.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.started = time.time()
+        self.duration = None
+        self.phases = dict()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.status_codes = list()
+        self.retries = 0
+        self.error = None
+        self._lock = threading.Lock()
+
+    def add_phase(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_response(self, status_code, bytes_sent, bytes_received):
+        with self._lock:
+            self.status_codes.append(status_code)
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+
+    def add_bytes_received(self, bytes_received):
+        with self._lock:
+            self.bytes_received += bytes_received
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def finish(self):
+        self.duration = time.time() - self.started
+        self.phases['total'] = self.duration
+
+
+class Instrumentation(object):
+    """
+    Observer notified by BaseXClient around every public method call; nested calls
+    (i.e. get_databases invoked by create_database) are accounted to the outer one.
+    Subclasses override call_started and call_finished, both receive a CallRecord.
+    """
+
+    def call_started(self, record):
+        pass
+
+    def call_finished(self, record):
+        pass
+
+
+class Histogram(object):
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile):
+        # upper bound of the bucket holding the given percentile (max for the last bucket)
+        if self.count == 0:
+            return None
+        rank = self.count * percentile / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.max)
+                return self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'buckets': zip(self.bounds + (float('inf'),), self.counts),
+        }
+
+
+class OperationMetrics(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = dict()
+        self.status_codes = dict()
+        self.retries = 0
+        self.latency = dict((phase, Histogram(LATENCY_BUCKETS)) for phase in PHASES)
+        self.bytes_sent = Histogram(BYTES_BUCKETS)
+        self.bytes_received = Histogram(BYTES_BUCKETS)
+
+    def add(self, record):
+        self.calls += 1
+        if record.error is not None:
+            self.errors[record.error] = self.errors.get(record.error, 0) + 1
+        for code in record.status_codes:
+            self.status_codes[code] = self.status_codes.get(code, 0) + 1
+        self.retries += record.retries
+        for phase, seconds in record.phases.iteritems():
+            self.latency[phase].observe(seconds)
+        self.bytes_sent.observe(record.bytes_sent)
+        self.bytes_received.observe(record.bytes_received)
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'errors': dict(self.errors),
+            'status_codes': dict(self.status_codes),
+            'retries': self.retries,
+            'latency': dict((phase, h.snapshot()) for phase, h in self.latency.iteritems()),
+            'bytes_sent': self.bytes_sent.snapshot(),
+            'bytes_received': self.bytes_received.snapshot(),
+        }
+
+
+class MetricsCollector(pbx_utils.PicklableLockMixin, Instrumentation):
+    """
+    Keeps in memory histograms of latencies (by phase) and of transferred bytes
+    for each operation; snapshot() returns them as plain dictionaries, ready to be
+    exported to an external metrics system.
+    """
+
+    def __init__(self):
+        self._operations = dict()
+        self._lock = threading.Lock()
+
+    def call_finished(self, record):
+        with self._lock:
+            if record.operation not in self._operations:
+                self._operations[record.operation] = OperationMetrics()
+            self._operations[record.operation].add(record)
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            snapshot = dict((op, metrics.snapshot()) for op, metrics in self._operations.iteritems())
+            if reset:
+                self._operations = dict()
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._operations = dict()
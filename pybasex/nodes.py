@@ -0,0 +1,83 @@
+import threading
+import time
+
+import errors as pbx_errors
+import utils as pbx_utils
+
+
+class NodesPool(pbx_utils.PicklableLockMixin):
+    """
+    Keeps track of the BaseX nodes a client talks to: writes always go to the
+    primary node (the first one), reads are spread among the healthy nodes.
+    Unreachable nodes are ejected for eject_timeout seconds.
+    """
+
+    STRATEGIES = ('round_robin', 'least_outstanding')
+
+    def __init__(self, urls, strategy='round_robin', eject_timeout=30):
+        if len(urls) == 0:
+            raise pbx_errors.ConfigurationError('At least one BaseX URL is required')
+        if strategy not in self.STRATEGIES:
+            raise pbx_errors.ConfigurationError('Unknown read strategy "%s"' % strategy)
+        self.urls = list(urls)
+        self.strategy = strategy
+        self.eject_timeout = eject_timeout
+        self._outstanding = dict((url, 0) for url in self.urls)
+        self._ejected = dict()
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def after_fork(self):
+        # the lock could be held by a thread of the parent, requests in flight are not ours
+        self._lock = threading.Lock()
+        self._outstanding = dict((url, 0) for url in self.urls)
+
+    @property
+    def primary(self):
+        return self.urls[0]
+
+    def _is_healthy(self, url):
+        ejected_until = self._ejected.get(url)
+        if ejected_until is None:
+            return True
+        if ejected_until <= time.time():
+            # give the node another chance
+            del self._ejected[url]
+            return True
+        return False
+
+    def healthy_nodes(self):
+        with self._lock:
+            return [url for url in self.urls if self._is_healthy(url)]
+
+    def select(self, read=True, exclude=()):
+        # returns None if every available node has been excluded
+        if not read:
+            return None if self.primary in exclude else self.primary
+        with self._lock:
+            candidates = [url for url in self.urls if url not in exclude and self._is_healthy(url)]
+            if len(candidates) == 0:
+                # no healthy node left, try the ejected ones anyway
+                candidates = [url for url in self.urls if url not in exclude]
+            if len(candidates) == 0:
+                return None
+            if self.strategy == 'least_outstanding':
+                return min(candidates, key=lambda url: self._outstanding[url])
+            self._next = (self._next + 1) % len(self.urls)
+            return candidates[self._next % len(candidates)]
+
+    def acquire(self, url):
+        with self._lock:
+            self._outstanding[url] += 1
+
+    def release(self, url):
+        with self._lock:
+            self._outstanding[url] -= 1
+
+    def eject(self, url):
+        with self._lock:
+            self._ejected[url] = time.time() + self.eject_timeout
+
+    def restore(self, url):
+        with self._lock:
+            self._ejected.pop(url, None)
@@ -0,0 +1,200 @@
+import socket
+from hashlib import md5
+
+import errors as pbx_errors
+
+BUFFER_SIZE = 64 * 1024
+
+# server protocol commands codes
+QUERY = '\x00'
+CLOSE = '\x02'
+BIND = '\x03'
+RESULTS = '\x04'
+EXECUTE = '\x05'
+CREATE = '\x08'
+ADD = '\x09'
+REPLACE = '\x0c'
+STORE = '\x0d'
+
+
+def _md5(s):
+    return md5(s).hexdigest()
+
+
+def _encode(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+
+def _escape(content):
+    # 0x00 and 0xFF bytes in binary contents are prefixed by 0xFF
+    return content.replace('\xff', '\xff\xff').replace('\x00', '\xff\x00')
+
+
+class ServerSession(object):
+    """
+    A session over the BaseX client/server protocol (by default, TCP port 1984),
+    on_connect is called with the session once its socket is open, before authenticating
+    """
+
+    def __init__(self, host, port, user, password, timeout=None, on_connect=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.info = None
+        self.opened_database = None
+        self._buffer = ''
+        self._pos = 0
+        try:
+            self._socket = socket.create_connection((host, port), timeout)
+            # every call is a small request followed by a response, don't wait for more data
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except socket.error, se:
+            raise pbx_errors.ConnectionError('Unable to connect to "%s:%d": %s' % (host, port, se))
+        if on_connect is not None:
+            on_connect(self)
+        self._authenticate(user or '', password or '')
+
+    @property
+    def sock(self):
+        # shut down by the losing attempt of a hedged call (see hedging.Attempt)
+        return self._socket
+
+    def _authenticate(self, user, password):
+        challenge = self._read_string()
+        if ':' in challenge:
+            # digest authentication, BaseX >= 8.0
+            realm, nonce = challenge.split(':', 1)
+            code = _md5(_md5('%s:%s:%s' % (user, realm, password)) + nonce)
+        else:
+            # CRAM-MD5 authentication
+            code = _md5(_md5(password) + challenge)
+        self._send(_encode(user) + '\x00' + code + '\x00')
+        if not self._read_ok():
+            raise pbx_errors.AuthenticationError('Access denied for user "%s"' % user)
+
+    # --- low level I/O
+    def _send(self, data):
+        try:
+            self._socket.sendall(data)
+        except socket.error, se:
+            raise pbx_errors.ConnectionError('Connection to "%s:%d" lost: %s' % (self.host, self.port, se))
+
+    def _fill(self):
+        try:
+            data = self._socket.recv(BUFFER_SIZE)
+        except socket.error, se:
+            raise pbx_errors.ConnectionError('Connection to "%s:%d" lost: %s' % (self.host, self.port, se))
+        if not data:
+            raise pbx_errors.ConnectionError('Connection closed by "%s:%d"' % (self.host, self.port))
+        self._buffer = data
+        self._pos = 0
+
+    def _read_byte(self):
+        if self._pos >= len(self._buffer):
+            self._fill()
+        byte = self._buffer[self._pos]
+        self._pos += 1
+        return byte
+
+    def _read_string(self):
+        # read a 0x00 terminated string, 0x00 and 0xFF bytes in the string are prefixed by 0xFF
+        parts = []
+        while True:
+            if self._pos >= len(self._buffer):
+                self._fill()
+            end = self._buffer.find('\x00', self._pos)
+            escape = self._buffer.find('\xff', self._pos)
+            if escape != -1 and (end == -1 or escape < end):
+                parts.append(self._buffer[self._pos:escape])
+                self._pos = escape + 1
+                parts.append(self._read_byte())
+            elif end == -1:
+                parts.append(self._buffer[self._pos:])
+                self._pos = len(self._buffer)
+            else:
+                parts.append(self._buffer[self._pos:end])
+                self._pos = end + 1
+                return ''.join(parts)
+
+    def _read_ok(self):
+        return self._read_byte() == '\x00'
+
+    # --- commands
+    def execute(self, command):
+        self._send(_encode(command) + '\x00')
+        result = self._read_string()
+        self.info = self._read_string()
+        if not self._read_ok():
+            raise pbx_errors.CommandError(self.info)
+        return result
+
+    def _send_input(self, code, path, content, escape=False):
+        # content is a string or an iterable of strings, sent one at a time
+        if isinstance(content, basestring):
+            content = [content]
+        self._send(code + _encode(path) + '\x00')
+        for chunk in content:
+            self._send(_escape(chunk) if escape else _encode(chunk))
+        self._send('\x00')
+        self.info = self._read_string()
+        if not self._read_ok():
+            raise pbx_errors.CommandError(self.info)
+
+    def create(self, name, content=''):
+        self._send_input(CREATE, name, content)
+
+    def add(self, path, content):
+        self._send_input(ADD, path, content)
+
+    def replace(self, path, content):
+        self._send_input(REPLACE, path, content)
+
+    def store(self, path, content):
+        self._send_input(STORE, path, content, escape=True)
+
+    def query(self, text):
+        return Query(self, text)
+
+    def _query_command(self, code, arg):
+        self._send(code + arg + '\x00')
+        result = self._read_string()
+        if not self._read_ok():
+            raise pbx_errors.QueryError(self._read_string())
+        return result
+
+    def close(self):
+        try:
+            self._send('exit\x00')
+        except pbx_errors.ConnectionError:
+            pass
+        self._socket.close()
+
+
+class Query(object):
+
+    def __init__(self, session, text):
+        self.session = session
+        self.id = session._query_command(QUERY, _encode(text))
+
+    def bind(self, name, value, value_type=''):
+        self.session._query_command(BIND, '\x00'.join([self.id, _encode(name), _encode(value),
+                                                       _encode(value_type)]))
+
+    def iter(self):
+        # items are received one at a time, each one preceded by its type
+        self.session._send(RESULTS + self.id + '\x00')
+        while True:
+            item_type = self.session._read_byte()
+            if item_type == '\x00':
+                break
+            yield self.session._read_string()
+        if not self.session._read_ok():
+            raise pbx_errors.QueryError(self.session._read_string())
+
+    def execute(self):
+        return self.session._query_command(EXECUTE, self.id)
+
+    def close(self):
+        self.session._query_command(CLOSE, self.id)
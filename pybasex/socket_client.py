@@ -0,0 +1,22 @@
+from basex_client import BaseXClient
+from transports import SocketTransport
+
+
+class BaseXSocketClient(BaseXClient):
+    """
+    BaseXClient working on top of the BaseX client/server protocol (persistent TCP
+    connections, see transports.SocketTransport) instead of the REST interface; url is
+    "basex://host:port" or a list of them, as for BaseXClient
+    """
+
+    DEFAULT_PORT = SocketTransport.DEFAULT_PORT
+
+    def __init__(self, url, default_database=None, user=None, password=None, logger=None,
+                 track_ids=False, query_cache=None, timeout=None, instrumentation=None,
+                 catalog_ttl=None, **kwargs):
+        super(BaseXSocketClient, self).__init__(url, default_database, user, password, logger,
+                                                track_ids, query_cache,
+                                                instrumentation=instrumentation,
+                                                catalog_ttl=catalog_ttl,
+                                                transport=SocketTransport(timeout), **kwargs)
+        self.timeout = timeout
@@ -0,0 +1,63 @@
+import json
+import os
+from hashlib import sha1
+
+import utils.xml_utils as pbx_xml_utils
+
+
+def document_hash(xml_doc):
+    # hash of the canonical form (C14N) of the document, insensitive to the serialization details
+    return sha1(pbx_xml_utils.xml_to_c14n(xml_doc)).hexdigest()
+
+
+class SyncManifest(object):
+    """
+    Local record of the documents written by BaseXClient.sync_documents: for each database
+    maps document IDs to the hash of their content and to their size, as listed by BaseX.
+    The manifest is kept in memory, or in a JSON file if a path is given (saved by
+    sync_documents, or explicitly with save()).
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self._databases = dict()
+        if path and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self.path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != self.VERSION:
+            raise ValueError('unsupported manifest version: %r' % manifest.get('version'))
+        self._databases = dict((db, dict((doc_id, tuple(entry)) for doc_id, entry in docs.iteritems()))
+                               for db, docs in manifest['databases'].iteritems())
+
+    def save(self):
+        if not self.path:
+            return
+        # write a new file and then replace the old one, a crash never leaves a broken manifest
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.VERSION, 'databases': self._databases}, f)
+        os.rename(tmp_path, self.path)
+
+    def documents(self, database):
+        return self._databases.setdefault(database, dict())
+
+    def get(self, database, document_id):
+        # (hash, size) or None, size is None until the document is listed by BaseX
+        return self._databases.get(database, {}).get(document_id)
+
+    def set(self, database, document_id, digest, size=None):
+        self.documents(database)[document_id] = (digest, size)
+
+    def discard(self, database, document_id):
+        self._databases.get(database, {}).pop(document_id, None)
+
+    def clear(self, database=None):
+        if database is None:
+            self._databases = dict()
+        else:
+            self._databases.pop(database, None)
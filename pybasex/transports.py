@@ -0,0 +1,401 @@
+import itertools
+import requests
+import time
+from datetime import timedelta
+from lxml import etree
+from lxml.etree import Element, SubElement
+from urlparse import urlparse
+
+import errors as pbx_errors
+from adapters import ClientAdapter, current_attempt, mark_request_sent
+from fragments import BASEX_XML_NSPACE
+from protocol import ServerSession
+import utils.xml_utils as pbx_xml_utils
+
+
+class Transport(object):
+    """
+    Carries the requests of a BaseXClient to the BaseX nodes. Requests are shaped on the
+    BaseX REST interface: method is GET, PUT, POST or DELETE, database and item select the
+    resource (the databases list, a database or one of its resources) and data is the
+    body of PUT and POST (the query XML) requests. request returns an object with the
+    subset of the requests.Response interface used by the client (status_code, content,
+    text, elapsed, iter_content and close) and raises requests.ConnectionError if the
+    node can't be reached, the node is then ejected (see BaseXClient._request).
+    Sessions are created by new_session, one for each thread, and can reach every node.
+    """
+
+    def new_session(self, user, password):
+        raise NotImplementedError()
+
+    def open(self, session, node):
+        # called by BaseXClient.connect with the session of the connecting thread and
+        # the primary node, nothing to do if connections are opened on demand
+        pass
+
+    def request(self, session, method, node, database=None, item=None, data=None,
+                content_type=None, stream=False, timeout=None):
+        raise NotImplementedError()
+
+
+class HTTPTransport(Transport):
+    """
+    The BaseX REST interface, nodes are REST URLs (i.e. http://localhost:8984/rest)
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, keep_alive=True):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+
+    def new_session(self, user, password):
+        session = requests.Session()
+        adapter = ClientAdapter(pool_connections=self.pool_connections,
+                                pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        if user and password:
+            session.auth = (user, password)
+        return session
+
+    @staticmethod
+    def build_url(node, database=None, item=None):
+        url = node
+        if database:
+            url = '/'.join([url, database])
+        if item:
+            url = '/'.join([url, item])
+        return url
+
+    def request(self, session, method, node, database=None, item=None, data=None,
+                content_type=None, stream=False, timeout=None):
+        headers = {'Content-Type': content_type} if content_type else None
+        return session.request(method, self.build_url(node, database, item), data=data,
+                               headers=headers, stream=stream, timeout=timeout)
+
+
+class ServerResponse(object):
+    """
+    The results of a server protocol call, with the subset of the requests.Response
+    interface used by BaseXClient
+    """
+
+    def __init__(self, status_code=requests.codes.ok, items=(), on_close=None):
+        self.status_code = status_code
+        self.elapsed = timedelta(0)
+        self._items = iter(items)
+        self._on_close = on_close
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            try:
+                self._content = ''.join(self._items)
+            finally:
+                self.close()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size=None):
+        # the protocol returns each result item as a whole, chunk_size is ignored
+        while True:
+            try:
+                item = next(self._items)
+            except StopIteration:
+                break
+            yield item
+        self.close()
+
+    def close(self):
+        self._release(keep=False)
+
+    def buffer(self):
+        # the results not read yet are kept in memory, the session can be used by another request
+        self._release(keep=True)
+
+    def _release(self, keep):
+        if self._on_close is None:
+            return
+        on_close, self._on_close = self._on_close, None
+        # results must be fully read before the session can be used again
+        items, error = list(), None
+        try:
+            for item in self._items:
+                if keep:
+                    items.append(item)
+        except (pbx_errors.QueryError, requests.ConnectionError), e:
+            error = e
+        if keep:
+            self._items = self._replay(items, error)
+        on_close()
+
+    @staticmethod
+    def _replay(items, error):
+        for item in items:
+            yield item
+        if error is not None:
+            raise error
+
+
+def _track(session):
+    # shut down if the other attempt of a hedged call wins (see hedging.Attempt)
+    attempt = current_attempt()
+    if attempt is not None:
+        attempt.track(session)
+
+
+class ServerSessions(object):
+    """
+    The server protocol sessions of a thread, one for each node, opened on first use
+    """
+
+    def __init__(self, transport, user, password):
+        self.transport = transport
+        self.user = user
+        self.password = password
+        self._sessions = dict()
+        # streamed responses not read yet, by node
+        self._streaming = dict()
+
+    def get(self, node):
+        streaming = self._streaming.pop(node, None)
+        if streaming is not None:
+            streaming.buffer()
+        session = self._sessions.get(node)
+        if session is None:
+            host, port = self.transport.address(node)
+            try:
+                session = ServerSession(host, port, self.user, self.password, self.transport.timeout,
+                                        on_connect=_track)
+            except pbx_errors.ConnectionError, ce:
+                raise requests.ConnectionError(str(ce))
+            self._sessions[node] = session
+        else:
+            _track(session)
+        return session
+
+    def stream(self, node, response):
+        self._streaming[node] = response
+
+    def streamed(self, node, response):
+        if self._streaming.get(node) is response:
+            del self._streaming[node]
+
+    def discard(self, node):
+        # the connection is broken, the next request opens a new one
+        self._streaming.pop(node, None)
+        session = self._sessions.pop(node, None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        self._streaming.clear()
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+
+class SocketTransport(Transport):
+    """
+    The BaseX client/server protocol (persistent TCP connections), nodes are
+    "basex://host:port" URLs. REST requests are mapped on commands and queries and the
+    databases and resources lists are returned in the REST format; timeout (seconds)
+    applies to every socket operation, the timeout of the requests is ignored
+    """
+
+    DEFAULT_PORT = 1984
+
+    LIST_DATABASES_QUERY = 'db:list-details()'
+    LIST_RESOURCES_QUERY = 'declare variable $db external; db:list-details($db)'
+    RESOURCE_QUERY = '''
+declare variable $db external;
+declare variable $path external;
+if (db:exists($db, $path))
+then (if (db:is-raw($db, $path)) then db:retrieve($db, $path) else db:open($db, $path))
+else ()
+'''
+    DELETE_DOCUMENT_QUERY = '''
+declare variable $db external;
+declare variable $path external;
+db:delete($db, $path)
+'''
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def address(self, node):
+        parsed_url = urlparse(node if '://' in node else 'basex://%s' % node)
+        return parsed_url.hostname or 'localhost', parsed_url.port or self.DEFAULT_PORT
+
+    def new_session(self, user, password):
+        return ServerSessions(self, user, password)
+
+    def open(self, session, node):
+        session.get(node)
+
+    def request(self, session, method, node, database=None, item=None, data=None,
+                content_type=None, stream=False, timeout=None):
+        start = time.time()
+        server = session.get(node)
+        try:
+            response = self._dispatch(session, node, server, method, database, item, data,
+                                      content_type, stream)
+        except pbx_errors.ConnectionError, ce:
+            session.discard(node)
+            raise requests.ConnectionError(str(ce))
+        response.elapsed = timedelta(seconds=time.time() - start)
+        return response
+
+    def _dispatch(self, session, node, server, method, database, item, data, content_type, stream):
+        if not database:
+            if method == 'GET':
+                return self._list_databases(session, node, server)
+        elif method == 'PUT' and not item:
+            server.execute('CREATE DB %s' % database)
+            server.opened_database = database
+            mark_request_sent()
+            return ServerResponse(requests.codes.created, [server.info])
+        elif not self._open(server, database):
+            return ServerResponse(requests.codes.not_found,
+                                  ['Database \'%s\' was not found.' % database])
+        elif not item:
+            if method == 'GET':
+                return self._list_resources(session, node, server, database)
+            if method == 'POST':
+                return self._query(session, node, server, data, stream)
+            if method == 'DELETE':
+                server.execute('CLOSE')
+                server.opened_database = None
+                server.execute('DROP DB %s' % database)
+                mark_request_sent()
+                return ServerResponse(items=[server.info])
+        else:
+            if method == 'GET':
+                return self._run(session, node, server, self.RESOURCE_QUERY,
+                                 [('db', database), ('path', item)], stream,
+                                 empty=self._empty_listing(database))
+            if method == 'PUT':
+                return self._store(server, item, data, content_type)
+            if method == 'DELETE':
+                return self._run(session, node, server, self.DELETE_DOCUMENT_QUERY,
+                                 [('db', database), ('path', item)])
+        return ServerResponse(requests.codes.method_not_allowed)
+
+    def _open(self, server, database):
+        if server.opened_database != database:
+            try:
+                server.execute('OPEN %s' % database)
+            except pbx_errors.CommandError:
+                server.opened_database = None
+                return False
+            server.opened_database = database
+        return True
+
+    def _store(self, server, item, data, content_type):
+        chunks = data
+        if hasattr(data, 'read'):
+            chunks = iter(lambda: data.read(self.STREAM_CHUNK_SIZE), '')
+        if content_type is None or content_type.split(';')[0].strip().endswith('xml'):
+            server.replace(item, chunks)
+        else:
+            server.store(item, chunks)
+        mark_request_sent()
+        return ServerResponse(requests.codes.created, [server.info])
+
+    def _query(self, session, node, server, data, stream):
+        q_frag = pbx_xml_utils.bytes_to_xml(data)
+        # serialization parameters become output declarations in the query prolog
+        options = ['declare option output:%s "%s";\n' % (p.get('name'), p.get('value').replace('"', '""'))
+                   for p in q_frag.findall('{%s}parameter' % BASEX_XML_NSPACE)]
+        variables = [(v.get('name'), v.get('value'), v.get('type') or '')
+                     for v in q_frag.findall('{%s}variable' % BASEX_XML_NSPACE)]
+        text = q_frag.find('{%s}text' % BASEX_XML_NSPACE).text
+        return self._run(session, node, server, ''.join(options) + text, variables, stream)
+
+    def _run(self, session, node, server, text, variables=(), stream=False, empty=None):
+        # errors raised before the first result are bad requests, as for the REST interface;
+        # the results of a streamed response are received while it is iterated
+        try:
+            query = server.query(text)
+        except pbx_errors.QueryError, qe:
+            return ServerResponse(requests.codes.bad, [str(qe)])
+        try:
+            for variable in variables:
+                query.bind(*variable)
+            mark_request_sent()
+            results = query.iter()
+            head = list(itertools.islice(results, 1) if stream else results)
+        except pbx_errors.QueryError, qe:
+            self._close_query(session, node, query)
+            return ServerResponse(requests.codes.bad, [str(qe)])
+        if not head and empty is not None:
+            head = [empty]
+        if not stream:
+            self._close_query(session, node, query)
+            return ServerResponse(items=head)
+        response = ServerResponse(items=self._iter_results(session, node, head, results),
+                                  on_close=lambda: self._close_streamed(session, node, query, response))
+        session.stream(node, response)
+        return response
+
+    def _iter_results(self, session, node, head, results):
+        for item in head:
+            yield item
+        try:
+            for item in results:
+                yield item
+        except pbx_errors.QueryError, qe:
+            raise pbx_errors.QueryError('Query error: ' + str(qe).replace('\n', ' '))
+        except pbx_errors.ConnectionError, ce:
+            session.discard(node)
+            raise requests.ConnectionError(str(ce))
+
+    def _close_streamed(self, session, node, query, response):
+        session.streamed(node, response)
+        self._close_query(session, node, query)
+
+    def _close_query(self, session, node, query):
+        try:
+            query.close()
+        except pbx_errors.QueryError:
+            pass
+        except pbx_errors.ConnectionError:
+            session.discard(node)
+
+    def _list_databases(self, session, node, server):
+        response = self._run(session, node, server, self.LIST_DATABASES_QUERY)
+        if response.status_code != requests.codes.ok:
+            return response
+        listing = Element('{%s}databases' % BASEX_XML_NSPACE, nsmap={'rest': BASEX_XML_NSPACE})
+        for item in response.iter_content():
+            db = etree.fromstring(item)
+            SubElement(listing, '{%s}database' % BASEX_XML_NSPACE, resources=db.get('resources'),
+                       size=db.get('size')).text = db.text
+        listing.set('resources', str(len(listing)))
+        return ServerResponse(items=[etree.tostring(listing)])
+
+    def _list_resources(self, session, node, server, database):
+        response = self._run(session, node, server, self.LIST_RESOURCES_QUERY, [('db', database)])
+        if response.status_code != requests.codes.ok:
+            return response
+        listing = Element('{%s}database' % BASEX_XML_NSPACE, nsmap={'rest': BASEX_XML_NSPACE},
+                          name=database)
+        for item in response.iter_content():
+            res = etree.fromstring(item)
+            SubElement(listing, '{%s}resource' % BASEX_XML_NSPACE,
+                       type='raw' if res.get('raw') == 'true' else 'xml',
+                       size=res.get('size'), **{'content-type': res.get('content-type')}).text = res.text
+        listing.set('resources', str(len(listing)))
+        return ServerResponse(items=[etree.tostring(listing)])
+
+    def _empty_listing(self, database):
+        # what the REST interface returns for a missing resource
+        return etree.tostring(Element('{%s}database' % BASEX_XML_NSPACE, nsmap={'rest': BASEX_XML_NSPACE},
+                                      name=database, resources='0'))
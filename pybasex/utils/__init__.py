@@ -1,4 +1,12 @@
 import logging
+import os
+import threading
+
+try:
+    # C based JSON decoder, if available
+    import ujson as json
+except ImportError:
+    import json
 
 LOG_FORMAT = '%(asctime)s|%(levelname)-8s|%(message)s'
 LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
@@ -28,3 +36,54 @@ def get_logger(name, level='INFO', file=None, mode='a', silent=False):
     handler.setFormatter(formatter)
     logger.addHandler(handler)
     return logger
+
+
+def reset_logger_locks(logger):
+    # handlers locks held by another thread of the parent process when it forked are
+    # never released in the child, replace them (for the handlers of the ancestors too)
+    while logger is not None:
+        for handler in logger.handlers:
+            handler.createLock()
+        logger = logger.parent if logger.propagate else None
+
+
+class PicklableLockMixin(object):
+    # locks can't be pickled: _lock is left out of the pickled state and a new one,
+    # built by _lock_factory, is created when the object is unpickled
+    _lock_factory = staticmethod(threading.Lock)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = self._lock_factory()
+
+
+def json_loads(str_doc):
+    return json.loads(str_doc)
+
+
+def chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_files(directory, extensions=None):
+    # yield (relative path, path) for every file in directory and its subdirectories,
+    # relative paths always use "/" as separator
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file_name in sorted(files):
+            if extensions and not file_name.lower().endswith(extensions):
+                continue
+            path = os.path.join(root, file_name)
+            yield os.path.relpath(path, directory).replace(os.sep, '/'), path
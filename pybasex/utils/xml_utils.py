@@ -1,5 +1,26 @@
+import codecs
+import re
+import threading
+from itertools import chain
 from lxml import etree
 
+PARSER_OPTIONS = {
+    'remove_blank_text': True,
+    'no_network': True,
+    'huge_tree': True,
+}
+
+# lxml parsers can't be shared among threads, keep one per thread
+_parsers = threading.local()
+
+
+def get_parser():
+    parser = getattr(_parsers, 'parser', None)
+    if parser is None:
+        parser = etree.XMLParser(**PARSER_OPTIONS)
+        _parsers.parser = parser
+    return parser
+
 
 def clean_str_doc(str_doc):
     return str_doc.replace('\n', '')
@@ -9,5 +30,109 @@ def str_to_xml(str_doc):
     return etree.fromstring(clean_str_doc(str_doc))
 
 
+def bytes_to_xml(bytes_doc):
+    return etree.fromstring(bytes_doc, get_parser())
+
+
+def wrapped_bytes_to_xml(bytes_doc, wrapper_tag='results'):
+    # parse a sequence of XML fragments as the children of a wrapper element,
+    # feeding the parser directly to avoid building a new, concatenated, string
+    parser = get_parser()
+    try:
+        parser.feed('<%s>' % wrapper_tag)
+        parser.feed(bytes_doc)
+        parser.feed('</%s>' % wrapper_tag)
+    except etree.XMLSyntaxError:
+        # reset parser status before propagating the error
+        try:
+            parser.close()
+        except etree.XMLSyntaxError:
+            pass
+        raise
+    return parser.close()
+
+
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+XML_DECLARATION = re.compile(r'^\s*<\?xml\s[^>]*?\?>')
+XML_ENCODING = re.compile(r'encoding\s*=\s*["\']([A-Za-z][A-Za-z0-9._-]*)["\']')
+
+
+def is_xml_string(str_doc):
+    # tell serialized XML documents (byte or unicode strings) apart from file paths
+    if isinstance(str_doc, unicode):
+        return str_doc.lstrip(u'\ufeff \t\r\n').startswith(u'<')
+    return str_doc.lstrip().startswith(('<',) + tuple(bom for bom, _ in BOMS))
+
+
+def decode_xml_bytes(bytes_doc):
+    # decode a serialized document as stated by its BOM or by its XML declaration (UTF-8
+    # if missing); the declaration is dropped, it doesn't describe the decoded document
+    for bom, encoding in BOMS:
+        if bytes_doc.startswith(bom):
+            str_doc = bytes_doc[len(bom):].decode(encoding)
+            break
+    else:
+        declaration = XML_DECLARATION.match(bytes_doc)
+        encoding = XML_ENCODING.search(declaration.group(0)) if declaration else None
+        str_doc = bytes_doc.decode(encoding.group(1) if encoding else 'utf-8')
+    return XML_DECLARATION.sub(u'', str_doc, count=1)
+
+
 def xml_to_str(xml_doc):
-    return etree.tostring(xml_doc)
\ No newline at end of file
+    return etree.tostring(xml_doc)
+
+
+def xml_to_unicode(xml_doc):
+    return etree.tostring(xml_doc, encoding=unicode)
+
+
+def xml_to_c14n(xml_doc):
+    # canonical XML (C14N) serialization, equivalent documents give the same bytes
+    return etree.tostring(xml_doc, method='c14n')
+
+
+def iter_xml_items(chunks, wrapper_tag='results', keep_text=False):
+    # incrementally parse a sequence of XML fragments (e.g. the body of a query response)
+    # yielding every top level element as soon as the following one is complete (its tail
+    # text is known by then); yielded elements are detached from the wrapper element so
+    # that memory usage does not grow with the results.
+    # If keep_text is True the text between elements (atomic and text items) is yielded
+    # as strings as well, adjacent atomic items are not split (as in execute_query results)
+    parser = etree.XMLPullParser(events=('start', 'end'), **PARSER_OPTIONS)
+    parser.feed('<%s>' % wrapper_tag)
+    root = None
+    previous = None
+    depth = 0
+    for data in chain(chunks, ['</%s>' % wrapper_tag]):
+        parser.feed(data)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 1:
+                    if previous is None:
+                        text, root.text = root.text, None
+                    else:
+                        text, previous.tail = previous.tail, None
+                        root.remove(previous)
+                        yield previous
+                    if keep_text and text and text.strip():
+                        yield text
+                    previous = elem
+    parser.close()
+    if previous is None:
+        text = root.text
+    else:
+        text, previous.tail = previous.tail, None
+        root.remove(previous)
+        yield previous
+    if keep_text and text and text.strip():
+        yield text
@@ -0,0 +1,217 @@
+import requests
+import threading
+import time
+from collections import OrderedDict
+
+import errors as pbx_errors
+from fragments import OVERWRITE_ERROR_CODE
+
+
+class BufferedWriter(object):
+    """
+    Write-behind buffer obtained by BaseXClient.buffered_writer: add, replace and delete
+    calls return immediately, operations are coalesced by document ID and written by a
+    background thread in batches (a single updating query for each batch) as soon as
+    max_documents or max_bytes are buffered, flush_interval seconds after the oldest
+    buffered operation, on flush() and on close().
+    Calls block while max_pending operations are waiting to be written. If a batch fails
+    its operations are written one by one, the failed ones are appended to failures as
+    (document ID, action, exception) tuples and passed to on_error, if given; adding a
+    document with an ID already in use fails with an OverwriteError.
+    """
+
+    def __init__(self, client, database, max_documents=100, max_bytes=1024 * 1024,
+                 flush_interval=1.0, max_pending=None, on_error=None):
+        if max_documents < 1:
+            raise ValueError('max_documents must be a positive integer')
+        self.client = client
+        self.database = database
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending or 10 * max_documents
+        self.on_error = on_error
+        self.failures = list()
+        self.written = 0
+        # document ID -> (action, document, buffering time)
+        self._pending = OrderedDict()
+        self._bytes = 0
+        self._in_flight = 0
+        self._force = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._session = client._new_session()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return None
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending) + self._in_flight
+
+    # --- public methods
+    def add(self, document, document_id=None):
+        # the document ID is generated if missing, an existing ID is reported as a failure
+        document_id, document = self.client._ingest_item((document_id, document))
+        self._enqueue(document_id, 'add', document)
+        return document_id
+
+    def replace(self, document_id, document):
+        document_id, document = self.client._ingest_item((document_id, document))
+        self._enqueue(document_id, 'replace', document)
+
+    def delete(self, document_id):
+        self._enqueue(document_id, 'delete', None)
+
+    def flush(self):
+        # blocks until every buffered operation has been written
+        with self._cond:
+            self._force = True
+            self._cond.notify_all()
+            while (self._pending or self._in_flight) and self._thread.is_alive():
+                self._cond.wait()
+            self._force = False
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._session.close()
+
+    # --- buffering
+    def _enqueue(self, document_id, action, document):
+        with self._cond:
+            while not self._closed and document_id not in self._pending and \
+                    len(self._pending) >= self.max_pending:
+                # backpressure, wait for the background thread to make room
+                self._cond.wait()
+            if self._closed:
+                raise pbx_errors.ConnectionClosedError('Writer closed')
+            previous = self._pending.get(document_id)
+            overwrite = False
+            if previous is None:
+                buffered_at = time.time()
+            else:
+                previous_action, previous_doc, buffered_at = previous
+                if action == 'add' and previous_action != 'delete':
+                    # the buffered operation already saves the document, the new one is a duplicate
+                    overwrite = True
+                else:
+                    # a buffered operation is superseded by the new one, add becomes replace
+                    # as the deleted document could have been saved by a previous operation
+                    self._bytes -= len(previous_doc or '')
+                    if action == 'add':
+                        action = 'replace'
+            if not overwrite:
+                self._pending[document_id] = (action, document, buffered_at)
+                self._bytes += len(document or '')
+                self._cond.notify_all()
+        if overwrite:
+            self._failed((action, document_id, document), self._overwrite_error(document_id))
+
+    def _flush_due(self):
+        if not self._pending:
+            return self._closed
+        return self._closed or self._force or len(self._pending) >= self.max_documents or \
+            self._bytes >= self.max_bytes or self._wait_time() == 0
+
+    def _wait_time(self):
+        if not self._pending:
+            return None
+        oldest = next(self._pending.itervalues())[2]
+        return max(0, oldest + self.flush_interval - time.time())
+
+    def _take_batch(self):
+        batch = list()
+        batch_bytes = 0
+        while self._pending and len(batch) < self.max_documents and \
+                (len(batch) == 0 or batch_bytes < self.max_bytes):
+            document_id, (action, document, _) = self._pending.popitem(last=False)
+            batch.append((action, document_id, document))
+            batch_bytes += len(document or '')
+        self._bytes -= batch_bytes
+        return batch
+
+    # --- background writes
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._flush_due():
+                    self._cond.wait(self._wait_time())
+                if not self._pending:
+                    # closed, nothing left to write
+                    self._cond.notify_all()
+                    return
+                batch = self._take_batch()
+                self._in_flight = len(batch)
+                self._cond.notify_all()
+            try:
+                self._write(batch)
+            finally:
+                with self._cond:
+                    self._in_flight = 0
+                    self._cond.notify_all()
+
+    def _bulk_update(self, updates):
+        try:
+            self.client._bulk_update(updates, self.database, self._session)
+        except requests.ConnectionError, ce:
+            raise self.client._connection_error(ce)
+
+    def _write(self, batch):
+        try:
+            self._bulk_update(batch)
+            written = batch
+        except Exception, e:
+            if len(batch) == 1:
+                written = list()
+                self._failed(batch[0], e)
+            else:
+                # the batch is atomic, find out which operations can't be written
+                self.client.logger.warning('Unable to write a batch of %d operations (%s), '
+                                           'writing them one by one', len(batch), e)
+                written = list()
+                for update in batch:
+                    try:
+                        self._bulk_update([update])
+                        written.append(update)
+                    except Exception, e:
+                        self._failed(update, e)
+        self.written += len(written)
+        self.client._update_ids_index(
+            self.database,
+            added=[doc_id for action, doc_id, _ in written if action != 'delete'],
+            removed=[doc_id for action, doc_id, _ in written if action == 'delete']
+        )
+        self.client._notify_write(self.database)
+        self.client.logger.debug('%d operations written to database %s', len(written), self.database)
+
+    def _overwrite_error(self, document_id):
+        return pbx_errors.OverwriteError('A document with ID "%s" already exists in database "%s"' %
+                                         (document_id, self.database))
+
+    def _failed(self, update, error):
+        action, document_id, _ = update
+        if action == 'add' and OVERWRITE_ERROR_CODE in str(error):
+            error = self._overwrite_error(document_id)
+        self.client.logger.error('Unable to %s document "%s": %s', action, document_id, error)
+        self.failures.append((document_id, action, error))
+        if self.on_error:
+            try:
+                self.on_error(document_id, action, error)
+            except Exception:
+                self.client.logger.exception('Error callback failed')
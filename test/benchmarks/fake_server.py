@@ -0,0 +1,181 @@
+import re, threading, time, BaseHTTPServer, SocketServer
+from xml.sax.saxutils import escape
+from lxml import etree
+
+REST_NS = 'http://basex.org/rest'
+
+
+def build_document(doc_id, payload_size):
+    # a document of (roughly) payload_size bytes
+    return '<tree id="%s"><leaf even="%d">%s</leaf></tree>' % (doc_id, doc_id % 2, 'x' * payload_size)
+
+
+class FakeBaseXHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Emulates the responses of the BaseX REST interface used by pybasex: databases and
+    resources listing, PUT/GET/DELETE of databases and documents, updating queries
+    (bulk ingestion), documents windows (also serialized by the server) and lookups by path,
+    pagination. Any other query returns the
+    first server.query_items stored documents, the query is not evaluated.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # write every response with a single send (flushed by handle_one_request), the
+    # client must not wait for delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body=''):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path(self):
+        # /rest/<database>/<document>
+        return self.path.split('?')[0].strip('/').split('/', 2)[1:]
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return ''.join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_GET(self):
+        dbs = self.server.databases
+        path = self._path()
+        if len(path) == 0:
+            return self._send(200, '<rest:databases xmlns:rest="%s">%s</rest:databases>' % (REST_NS, ''.join(
+                '<rest:database resources="%d" size="%d">%s</rest:database>' %
+                (len(docs), sum(len(d) for d in docs.itervalues()), name)
+                for name, docs in dbs.items())))
+        if path[0] not in dbs:
+            return self._send(404, 'Database \'%s\' was not found.' % path[0])
+        docs = dbs[path[0]]
+        if len(path) == 1:
+            return self._send(200, '<rest:database xmlns:rest="%s" name="%s" resources="%d">%s</rest:database>' % (
+                REST_NS, path[0], len(docs), ''.join(
+                    '<rest:resource type="xml" content-type="application/xml" size="%d">%s</rest:resource>' %
+                    (len(doc), doc_id) for doc_id, doc in docs.items())))
+        doc = docs.get(path[1])
+        if doc is None:
+            return self._send(200, '<rest:database xmlns:rest="%s" name="%s" resources="0"/>' % (REST_NS, path[0]))
+        return self._send(200, doc)
+
+    def do_PUT(self):
+        dbs = self.server.databases
+        path = self._path()
+        body = self._body()
+        if len(path) == 1:
+            dbs[path[0]] = dict()
+            return self._send(201, 'Database \'%s\' created.' % path[0])
+        if path[0] not in dbs:
+            return self._send(404, 'Database \'%s\' was not found.' % path[0])
+        dbs[path[0]][path[1]] = body
+        return self._send(201, '1 resource(s) replaced.')
+
+    def do_DELETE(self):
+        dbs = self.server.databases
+        path = self._path()
+        if len(path) == 0 or path[0] not in dbs:
+            return self._send(404, 'Database \'%s\' was not found.' % (path or [''])[0])
+        if len(path) == 1:
+            del dbs[path[0]]
+            return self._send(200, 'Database \'%s\' was dropped.' % path[0])
+        dbs[path[0]].pop(path[1], None)
+        return self._send(200, '1 resource(s) deleted.')
+
+    def do_POST(self):
+        dbs = self.server.databases
+        path = self._path()
+        body = self._body()
+        if len(path) == 0 or path[0] not in dbs:
+            return self._send(404, 'Database \'%s\' was not found.' % (path or [''])[0])
+        docs = dbs[path[0]]
+        query = etree.fromstring(body)
+        text = query.find('{%s}text' % REST_NS).text
+        variables = dict((v.get('name'), v.get('value')) for v in query.findall('{%s}variable' % REST_NS))
+        if 'then db:open($db, $path)' in text:
+            return self._send(200, docs.get(variables['path'], ''))
+        if 'serialize($doc' in text:
+            start, size = int(variables['start']), int(variables['size'])
+            return self._send(200, ''.join('<document path="%s">%s</document>' % (doc_id, escape(doc)) for doc_id, doc in
+                                           sorted(docs.items())[start - 1:start - 1 + size]))
+        if 'tokenize($paths' in text:
+            return self._send(200, ''.join('<document path="%s">%s</document>' % (doc_id, docs[doc_id])
+                                           for doc_id in variables['paths'].split('\n') if doc_id in docs))
+        if 'db:exists($db, $path)' in text:
+            return self._send(200, 'true' if variables['path'] in docs else 'false')
+        if 'subsequence(db:open($db)' in text:
+            start, size = int(variables['start']), int(variables['size'])
+            return self._send(200, ''.join('<document path="%s">%s</document>' % (doc_id, doc) for doc_id, doc in
+                                           sorted(docs.items())[start - 1:start - 1 + size]))
+        updates = re.findall(r'db:(add|replace|delete)\(\$db, (?:parse-xml\(\$d\d+\), )?\$p(\d+)', text)
+        if updates:
+            if any(action == 'add' and variables['p' + index] in docs for action, index in updates):
+                return self._send(400, 'Stopped at 1/1: [pybasex:overwrite] document already exists')
+            for action, index in updates:
+                if action == 'delete':
+                    docs.pop(variables['p' + index], None)
+                else:
+                    docs[variables['p' + index]] = variables['d' + index].encode('utf-8')
+            return self._send(200)
+        results = [doc for _, doc in sorted(docs.items())[:self.server.query_items]]
+        if 'pybasex_start' in variables:
+            start, size = int(variables['pybasex_start']), int(variables['pybasex_size'])
+            results = ['<pybasex-item>%s</pybasex-item>' % doc for doc in results[start - 1:start - 1 + size]]
+        return self._send(200, ''.join(results))
+
+
+class FakeBaseXServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    In-process stand-in for a BaseX HTTP server, every response is delayed by
+    latency seconds; use it as a context manager or call start() and stop()
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0, query_items=None, host='127.0.0.1', port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), FakeBaseXHandler)
+        self.latency = latency
+        self.query_items = query_items
+        self.databases = dict()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d/rest' % self.server_address
+
+    def populate(self, database, count, payload_size):
+        self.databases[database] = dict(('doc_%08d' % x, build_document(x, payload_size))
+                                        for x in xrange(0, count))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return None
@@ -0,0 +1,76 @@
+import os, unittest, sys
+from lxml.etree import Element, SubElement
+
+from pybasex import AsyncBaseXClient, BaseXClient
+from pybasex.utils import get_logger
+import pybasex.errors as pbx_errors
+
+
+class TestAsyncBaseXClient(unittest.TestCase):
+
+    def __init__(self, label):
+        super(TestAsyncBaseXClient, self).__init__(label)
+        self.db_name = 'test_basex_async'
+        self.basex_url = os.getenv('BASEX_BASE_URL')
+        self.basex_user = os.getenv('BASEX_USER')
+        self.basex_passwd = os.getenv('BASEX_PASSWD')
+
+    def _build_documents(self, pool_size):
+        documents = []
+        for x in xrange(0, pool_size):
+            tree = Element('tree')
+            tree.set('id', '%s' % (x+1))
+            SubElement(tree, 'leaf')
+            documents.append(tree)
+        return documents
+
+    def setUp(self):
+        if self.basex_url is None:
+            sys.exit('ERROR: no base URL for BaseX database provided')
+
+    def tearDown(self):
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            try:
+                bx_client.delete_database()
+            except pbx_errors.UnknownDatabaseError:
+                pass
+
+    def test_connect(self):
+        c = AsyncBaseXClient(self.basex_url, self.db_name, self.basex_user,
+                             self.basex_passwd, logger=get_logger('test', silent=True))
+        with self.assertRaises(pbx_errors.ConnectionClosedError):
+            c.get_databases()
+        self.assertFalse(c.connected)
+        c.connect()
+        self.assertTrue(c.connected)
+        c.disconnect()
+        self.assertFalse(c.connected)
+
+    def test_concurrent_requests(self):
+        with AsyncBaseXClient(self.basex_url, default_database=self.db_name,
+                              user=self.basex_user, password=self.basex_passwd,
+                              logger=get_logger('test', silent=True),
+                              max_concurrency=4) as bx_client:
+            bx_client.create_database().get()
+            pending = [bx_client.add_document(doc, 'test_document_%03d' % int(doc.get('id')))
+                       for doc in self._build_documents(20)]
+            ids = AsyncBaseXClient.gather(pending)
+            self.assertEqual(len(set(ids)), 20)
+            self.assertEqual(len(bx_client.get_resources().get()), 20)
+            with self.assertRaises(pbx_errors.OverwriteError):
+                bx_client.add_document(Element('tree'), 'test_document_001').get()
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                bx_client.get_resources('test_fake').get()
+
+
+def suite():
+    tests_suite = unittest.TestSuite()
+    tests_suite.addTest(TestAsyncBaseXClient('test_connect'))
+    tests_suite.addTest(TestAsyncBaseXClient('test_concurrent_requests'))
+    return tests_suite
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite())
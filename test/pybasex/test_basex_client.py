@@ -1,12 +1,19 @@
-import os, unittest, sys
+import os, pickle, socket, unittest, shutil, sys, tempfile, threading, time
+from multiprocessing import Pool
+from StringIO import StringIO
 from lxml.etree import fromstring, Element, SubElement, _Element
 from collections import Counter
 
-from pybasex import BaseXClient
+from pybasex import BaseXClient, QueryCache, HedgingPolicy, MetricsCollector
 from pybasex.utils import get_logger
 import pybasex.errors as pbx_errors
 
 
+def _count_resources(bx_client):
+    # runs in a worker process, the client is pickled
+    return os.getpid(), len(bx_client.get_resources())
+
+
 class TestBaseXClient(unittest.TestCase):
 
     def __init__(self, label):
@@ -58,11 +65,214 @@ class TestBaseXClient(unittest.TestCase):
             self.assertTrue(bx_client.connected)
         self.assertFalse(bx_client.connected)
 
+    def _wait_released_sessions(self, bx_client, count):
+        # thread locals (and the sessions) are released a little after the thread exits
+        for _ in xrange(0, 100):
+            if len(bx_client._sessions) <= count:
+                break
+            time.sleep(0.01)
+
+    def test_thread_sessions(self):
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            bx_client.create_database()
+            session = bx_client.session
+            self.assertIs(bx_client.session, session)
+            sessions = []
+
+            def run():
+                sessions.append(bx_client.session)
+                bx_client.add_documents(self._build_documents(2))
+            threads = [threading.Thread(target=run) for _ in xrange(0, 3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(len(set(id(s) for s in sessions + [session])), 4)
+            self.assertEqual(len(bx_client.get_resources()), 6)
+            # sessions of the terminated threads are closed and released
+            self._wait_released_sessions(bx_client, 1)
+            self.assertEqual(bx_client._sessions.values(), [session])
+            for _ in xrange(0, 5):
+                list(bx_client.paginate_query('/tree', 2))
+            for _ in xrange(0, 5):
+                t = threading.Thread(target=lambda: bx_client.session)
+                t.start()
+                t.join()
+            self._wait_released_sessions(bx_client, 1)
+            self.assertEqual(len(bx_client._sessions), 1)
+        self.assertIsNone(bx_client.session)
+
+    def test_fork_safety(self):
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True), track_ids=True,
+                         query_cache=QueryCache(max_size=10, ttl=60), catalog_ttl=60) as bx_client:
+            bx_client.create_database()
+            bx_client.add_documents(self._build_documents(3))
+            # cached results (lxml trees) and the databases state are not pickled
+            self.assertEqual(len(bx_client.execute_query('/tree')), 3)
+            self.assertEqual(len(bx_client.query_cache), 1)
+            # a pickled client is connected again in the worker processes
+            pool = Pool(2)
+            try:
+                results = pool.map(_count_resources, [bx_client] * 4)
+            finally:
+                pool.close()
+                pool.join()
+            self.assertEqual([count for _, count in results], [3] * 4)
+            self.assertNotIn(os.getpid(), [pid for pid, _ in results])
+            clone = pickle.loads(pickle.dumps(bx_client))
+            self.assertTrue(clone.connected)
+            self.assertEqual(len(clone.query_cache), 0)
+            self.assertEqual((clone.query_cache.max_size, clone.query_cache.ttl), (10, 60))
+            self.assertEqual(clone._ids_index, {})
+            self.assertEqual(len(clone.execute_query('/tree')), 3)
+            self.assertEqual(len(bx_client.query_cache), 1)
+            self.assertEqual(len(clone.get_resources()), 3)
+            clone.disconnect()
+            # the sessions inherited from the parent are dropped, not closed
+            session = bx_client.session
+            bx_client._pid = -1
+            self.assertIsNot(bx_client.session, session)
+            self.assertEqual(len(bx_client.get_resources()), 3)
+
     def test_connection_error(self):
         with BaseXClient('http://localhost:1', logger=get_logger('test', silent=True)) as bx_client:
             with self.assertRaises(pbx_errors.ConnectionError):
                 bx_client.get_databases()
 
+    def test_multiple_nodes(self):
+        fake_node = 'http://localhost:1'
+        with BaseXClient([self.basex_url, fake_node], default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            self.assertEqual(bx_client.url, self.basex_url)
+            bx_client.create_database()
+            for x in xrange(0, 4):
+                self.assertIn(self.db_name, bx_client.get_databases())
+            self.assertEqual(bx_client.nodes.healthy_nodes(), [self.basex_url])
+        with BaseXClient([self.basex_url, fake_node], default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            # queries pinned to the primary node never go to the replicas
+            for x in xrange(0, 4):
+                bx_client.execute_query('/tree', primary=True)
+            self.assertEqual(bx_client.nodes.healthy_nodes(), [self.basex_url, fake_node])
+        with BaseXClient([fake_node, self.basex_url], default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            self.assertIn(self.db_name, bx_client.get_databases())
+            with self.assertRaises(pbx_errors.ConnectionError):
+                bx_client.delete_database()
+
+    def test_hedged_reads(self):
+        str_doc = '<tree><leaf id=\'1\'/></tree>'
+        # a zero delay fires a hedge request for every read
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True),
+                         hedging=HedgingPolicy(min_delay=0, max_delay=0)) as bx_client:
+            bx_client.create_database()
+            bx_client.add_document(fromstring(str_doc), 'test_document_001')
+            for x in xrange(0, 5):
+                doc = bx_client.get_document('test_document_001')
+                self.assertEqual(doc.tag, 'tree')
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                bx_client.get_resources('test_fake')
+            stats = bx_client.hedging.stats()
+            self.assertEqual(stats['calls'], stats['fired'])
+            self.assertGreaterEqual(stats['calls'], 6)
+            # queries could be updating ones, they are hedged only if asked to
+            bx_client.execute_query('/tree')
+            self.assertEqual(bx_client.hedging.stats()['calls'], stats['calls'])
+            results = bx_client.execute_query('/tree', hedge=True)
+            self.assertEqual(len(results), 1)
+            self.assertEqual(bx_client.hedging.stats()['calls'], stats['calls'] + 1)
+
+    def test_hedged_reads_stalled_node(self):
+        str_doc = '<tree><leaf id=\'1\'/></tree>'
+        # a node accepting connections and never answering
+        stalled = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        stalled.bind(('127.0.0.1', 0))
+        stalled.listen(50)
+        accepted = list()
+
+        def accept():
+            while True:
+                try:
+                    accepted.append(stalled.accept()[0])
+                except socket.error:
+                    return
+        acceptor = threading.Thread(target=accept)
+        acceptor.daemon = True
+        acceptor.start()
+        stalled_url = 'http://127.0.0.1:%d/rest' % stalled.getsockname()[1]
+        try:
+            with BaseXClient(self.basex_url, default_database=self.db_name,
+                             user=self.basex_user, password=self.basex_passwd,
+                             logger=get_logger('test', silent=True)) as bx_client:
+                bx_client.create_database()
+                bx_client.add_document(fromstring(str_doc), 'test_document_001')
+            with BaseXClient([self.basex_url, stalled_url], default_database=self.db_name,
+                             user=self.basex_user, password=self.basex_passwd,
+                             logger=get_logger('test', silent=True),
+                             hedging=HedgingPolicy(min_delay=0.05, max_delay=0.05, pool_size=1)) as bx_client:
+                # the requests to the stalled node are aborted when the hedges win, they
+                # don't hold the only hedging worker
+                for x in xrange(0, 10):
+                    self.assertEqual(bx_client.get_document('test_document_001').tag, 'tree')
+                stats = bx_client.hedging.stats()
+                self.assertGreater(stats['won'], 0)
+                self.assertEqual(stats['won'], stats['fired'])
+                # a slow node is not an unreachable one
+                self.assertEqual(bx_client.nodes.healthy_nodes(), [self.basex_url, stalled_url])
+        finally:
+            stalled.close()
+            for conn in accepted:
+                conn.close()
+
+    def test_metrics(self):
+        str_doc = '<tree><leaf id=\'1\'/></tree>'
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True),
+                         instrumentation=MetricsCollector()) as bx_client:
+            bx_client.create_database()
+            bx_client.add_document(fromstring(str_doc), 'test_document_001')
+            for x in xrange(0, 3):
+                bx_client.get_document('test_document_001')
+            with self.assertRaises(pbx_errors.QueryError):
+                bx_client.execute_query('/tree//leaf[@id="1"]/ancstr-or-self::leaf')
+            metrics = bx_client.instrumentation.snapshot(reset=True)
+            # nested calls (get_databases invoked by create_database) are not recorded
+            self.assertNotIn('get_databases', metrics)
+            self.assertEqual(metrics['create_database']['calls'], 1)
+            self.assertEqual(sum(metrics['create_database']['status_codes'].values()), 2)
+            get_doc = metrics['get_document']
+            self.assertEqual(get_doc['calls'], 3)
+            for phase in ('total', 'request', 'server', 'response', 'parse'):
+                self.assertEqual(get_doc['latency'][phase]['count'], 3)
+            self.assertGreater(get_doc['bytes_received']['sum'], 0)
+            self.assertGreater(metrics['add_document']['bytes_sent']['sum'], 0)
+            self.assertEqual(metrics['execute_query']['errors'], {'QueryError': 1})
+            self.assertEqual(metrics['execute_query']['status_codes'], {400: 1})
+            self.assertEqual(bx_client.instrumentation.snapshot(), {})
+            # streamed results are recorded once consumed, with the bytes actually received
+            items = bx_client.iter_query('/tree')
+            self.assertEqual(bx_client.instrumentation.snapshot(), {})
+            self.assertEqual(len(list(items)), 1)
+            iter_query = bx_client.instrumentation.snapshot(reset=True)['iter_query']
+            self.assertEqual(iter_query['calls'], 1)
+            self.assertEqual(iter_query['latency']['response']['count'], 1)
+            self.assertGreaterEqual(iter_query['bytes_received']['sum'], len(str_doc))
+            # requests sent while iterating are accounted to the call
+            self.assertEqual(len(list(bx_client.iter_documents(batch_size=1))), 1)
+            iter_documents = bx_client.instrumentation.snapshot(reset=True)['iter_documents']
+            self.assertEqual(iter_documents['status_codes'], {200: 2})
+            self.assertGreater(iter_documents['bytes_received']['sum'], 0)
+
     def test_create_database(self):
         with BaseXClient(self.basex_url, default_database=self.db_name,
                          user=self.basex_user, password=self.basex_passwd,
@@ -73,6 +283,43 @@ class TestBaseXClient(unittest.TestCase):
             with self.assertRaises(pbx_errors.OverwriteError):
                 bx_client.create_database()
 
+    def test_databases_catalog(self):
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True), catalog_ttl=60,
+                         instrumentation=MetricsCollector()) as bx_client:
+            self.assertFalse(bx_client.database_exists())
+            bx_client.create_database()
+            self.assertTrue(bx_client.database_exists())
+            with self.assertRaises(pbx_errors.OverwriteError):
+                bx_client.create_database()
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                bx_client.get_document('test_document_001', database='test_fake')
+            metrics = bx_client.instrumentation.snapshot(reset=True)
+            # missing databases are always listed again, existing ones come from the catalog
+            self.assertEqual(metrics['database_exists']['status_codes'], {200: 1})
+            self.assertEqual(sum(metrics['create_database']['status_codes'].values()), 2)
+            self.assertEqual(metrics['get_document']['status_codes'], {404: 1})
+            # the database is deleted by another client, the catalog is stale
+            with BaseXClient(self.basex_url, user=self.basex_user, password=self.basex_passwd,
+                             logger=get_logger('test', silent=True)) as other_client:
+                other_client.delete_database(self.db_name)
+            self.assertTrue(bx_client.database_exists())
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                bx_client.get_resources()
+            self.assertFalse(bx_client.database_exists())
+            self.assertNotIn(self.db_name, bx_client.refresh_catalog())
+            # the database is created by another client, it is never replaced
+            with BaseXClient(self.basex_url, default_database=self.db_name, user=self.basex_user,
+                             password=self.basex_passwd, logger=get_logger('test', silent=True)) as other_client:
+                other_client.create_database()
+                other_client.add_document(Element('tree'), 'test_document_001')
+            with self.assertRaises(pbx_errors.OverwriteError):
+                bx_client.create_database()
+            self.assertEqual(len(bx_client.get_resources()), 1)
+            bx_client.delete_database()
+            self.assertFalse(bx_client.database_exists())
+
     def test_delete_database(self):
         with BaseXClient(self.basex_url, default_database=self.db_name,
                          user=self.basex_user, password=self.basex_passwd,
@@ -136,6 +383,204 @@ class TestBaseXClient(unittest.TestCase):
             self.assertEqual(len(dupl), 10)
             self.assertEqual(len(bx_client.get_resources()), 40)
 
+    def test_add_documents_parallel(self):
+        str_doc_template = '<tree id=\'%d\'><leaf id=\'1\'/></tree>'
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            bx_client.create_database()
+            docs = [fromstring(str_doc_template % x) for x in xrange(0, 30)]
+            ids, dupl = bx_client.add_documents(docs, max_workers=4)
+            self.assertEqual(len(ids), 30)
+            self.assertEqual(len(dupl), 0)
+            self.assertEqual(len(bx_client.get_resources()), 30)
+            docs = {'test_document_%03d' % x: fromstring(str_doc_template % x)
+                    for x in xrange(0, 10)}
+            docs['test_document_bad'] = None
+            with self.assertRaises(TypeError):
+                bx_client.add_documents(docs, max_workers=4)
+            self.assertEqual(len(bx_client.get_resources()), 30)
+
+    def test_add_documents_bulk(self):
+        str_doc_template = '<tree id=\'%d\'><leaf id=\'1\'>{text}</leaf></tree>'
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            bx_client.create_database()
+            docs = [fromstring(str_doc_template % x) for x in xrange(0, 25)]
+            ids, dupl = bx_client.add_documents(docs, chunk_size=10)
+            self.assertEqual(len(ids), 25)
+            self.assertEqual(len(dupl), 0)
+            self.assertEqual(len(bx_client.get_resources()), 25)
+            doc = bx_client.get_document(ids[0])
+            self.assertEqual(doc.find('leaf').text, '{text}')
+            docs = {'test_document_%03d' % x: fromstring(str_doc_template % x)
+                    for x in xrange(0, 25)}
+            ids, dupl = bx_client.add_documents(docs, chunk_size=10, max_workers=2)
+            self.assertEqual(sorted(ids), sorted(docs.keys()))
+            self.assertEqual(len(bx_client.get_resources()), 50)
+            docs = {'test_document_%03d' % x: fromstring(str_doc_template % x)
+                    for x in xrange(100, 120)}
+            docs['test_document_bad'] = None
+            with self.assertRaises(TypeError):
+                bx_client.add_documents(docs, chunk_size=5)
+            self.assertEqual(len(bx_client.get_resources()), 50)
+
+    def test_ingest(self):
+        str_doc_template = '<tree id=\'%d\'><leaf id=\'1\'/></tree>'
+        docs_dir = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(docs_dir, 'nested'))
+            for x in xrange(0, 7):
+                with open(os.path.join(docs_dir, 'doc_%d.xml' % x), 'w') as f:
+                    f.write(str_doc_template % x)
+            with open(os.path.join(docs_dir, 'nested', 'doc_7.xml'), 'w') as f:
+                f.write('<?xml version="1.0" encoding="UTF-8"?>' + str_doc_template % 7)
+            with open(os.path.join(docs_dir, 'notes.txt'), 'w') as f:
+                f.write('not a document')
+            with BaseXClient(self.basex_url, default_database=self.db_name,
+                             user=self.basex_user, password=self.basex_passwd,
+                             logger=get_logger('test', silent=True)) as bx_client:
+                bx_client.create_database()
+                chunks = []
+                count = bx_client.ingest(docs_dir, chunk_size=3,
+                                         progress=lambda total, ids: chunks.append((total, ids)))
+                self.assertEqual(count, 8)
+                self.assertEqual([total for total, _ in chunks], [3, 6, 8])
+                self.assertIn('nested/doc_7.xml', bx_client.get_resources())
+                self.assertEqual(bx_client.get_document('doc_3.xml').get('id'), '3')
+                # ingesting the same files again replaces the documents
+                self.assertEqual(bx_client.ingest(docs_dir), 8)
+                self.assertEqual(len(bx_client.get_resources()), 8)
+
+                def documents():
+                    yield fromstring(str_doc_template % 10)
+                    yield str_doc_template % 11
+                    yield ('test_document_012', str_doc_template % 12)
+                    yield os.path.join(docs_dir, 'doc_0.xml')
+                self.assertEqual(bx_client.ingest(documents(), chunk_size=2), 4)
+                self.assertEqual(len(bx_client.get_resources()), 11)
+                self.assertEqual(bx_client.get_document('test_document_012').get('id'), '12')
+                with self.assertRaises(TypeError):
+                    bx_client.ingest([None])
+                # unicode paths are paths, files are decoded as declared
+                with open(os.path.join(docs_dir, 'latin.xml'), 'wb') as f:
+                    f.write('<?xml version="1.0" encoding="ISO-8859-1"?><tree id="\xe8"/>')
+                self.assertEqual(bx_client.ingest(unicode(os.path.join(docs_dir, 'latin.xml'))), 1)
+                self.assertEqual(bx_client.get_document('latin.xml').get('id'), u'\xe8')
+                self.assertEqual(bx_client.ingest(unicode(docs_dir)), 9)
+                self.assertEqual(bx_client.get_document('nested/doc_7.xml').get('id'), '7')
+                self.assertEqual(bx_client.ingest([u'<tree id="13"/>']), 1)
+        finally:
+            shutil.rmtree(docs_dir)
+
+    def test_buffered_writer(self):
+        str_doc_template = '<tree id=\'%d\'><leaf id=\'1\'/></tree>'
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            bx_client.create_database()
+            errors = []
+            with bx_client.buffered_writer(max_documents=5, flush_interval=0.05,
+                                           on_error=lambda *args: errors.append(args)) as writer:
+                ids = [writer.add(fromstring(str_doc_template % x)) for x in xrange(0, 12)]
+                writer.add(str_doc_template % 100, 'test_document_100')
+                writer.replace('test_document_100', str_doc_template % 101)
+                writer.delete(ids[0])
+                writer.flush()
+                self.assertEqual(len(writer), 0)
+                self.assertEqual(len(bx_client.get_resources()), 12)
+                self.assertEqual(bx_client.get_document('test_document_100').get('id'), '101')
+                # a broken document doesn't prevent the rest of the batch from being written
+                writer.add('<tree><leaf>', 'test_document_bad')
+                writer.add(str_doc_template % 200, 'test_document_200')
+                # adding an ID already in use doesn't duplicate the document
+                writer.add(str_doc_template % 102, 'test_document_100')
+                writer.flush()
+                # neither does adding twice a buffered ID, the first add is kept
+                writer.add(str_doc_template % 300, 'test_document_300')
+                writer.add(str_doc_template % 301, 'test_document_300')
+                # a deleted document can be added again
+                writer.delete('test_document_200')
+                writer.add(str_doc_template % 201, 'test_document_200')
+            self.assertTrue(writer.closed)
+            self.assertEqual([f[0] for f in writer.failures],
+                             ['test_document_bad', 'test_document_100', 'test_document_300'])
+            for document_id, action, error in writer.failures[1:]:
+                self.assertEqual(action, 'add')
+                self.assertIsInstance(error, pbx_errors.OverwriteError)
+            self.assertEqual(len(errors), 3)
+            self.assertEqual(bx_client.get_document('test_document_200').get('id'), '201')
+            self.assertEqual(bx_client.get_document('test_document_100').get('id'), '101')
+            self.assertEqual(bx_client.get_document('test_document_300').get('id'), '300')
+            self.assertEqual(len(bx_client.get_resources()), 14)
+            with self.assertRaises(pbx_errors.ConnectionClosedError):
+                writer.add(str_doc_template % 400)
+
+    def test_resources(self):
+        binary = ''.join(chr(x % 256) for x in xrange(0, 300000))
+        str_doc = '<tree><leaf id=\'1\'/><leaf id=\'2\'/></tree>'
+        res_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(res_dir, 'data.bin'), 'wb') as f:
+                f.write(binary)
+            with BaseXClient(self.basex_url, default_database=self.db_name,
+                             user=self.basex_user, password=self.basex_passwd,
+                             logger=get_logger('test', silent=True)) as bx_client:
+                bx_client.create_database()
+                res_id = bx_client.store_resource(os.path.join(res_dir, 'data.bin'),
+                                                  content_type=BaseXClient.RAW_CONTENT_TYPE)
+                self.assertEqual(res_id, 'data.bin')
+                self.assertIn('data.bin', bx_client.get_resources())
+                written = bx_client.fetch_resource('data.bin', os.path.join(res_dir, 'copy.bin'),
+                                                   chunk_size=4096)
+                self.assertEqual(written, len(binary))
+                with open(os.path.join(res_dir, 'copy.bin'), 'rb') as f:
+                    self.assertEqual(f.read(), binary)
+                # unknown size, chunked transfer
+                chunks = (binary[x:x + 1000] for x in xrange(0, len(binary), 1000))
+                bx_client.store_resource(chunks, 'data_chunked.bin', content_type=BaseXClient.RAW_CONTENT_TYPE)
+                dest = StringIO()
+                bx_client.fetch_resource('data_chunked.bin', dest)
+                self.assertEqual(dest.getvalue(), binary)
+                bx_client.store_resource(StringIO(str_doc), 'test_document_001')
+                self.assertEqual(len(bx_client.get_document('test_document_001').getchildren()), 2)
+                self.assertIsNone(bx_client.fetch_resource('test_fake', os.path.join(res_dir, 'fake')))
+                # the empty listing is recognised even if split among many chunks
+                self.assertIsNone(bx_client.fetch_resource('test_fake', os.path.join(res_dir, 'fake'),
+                                                           chunk_size=8))
+                dest = StringIO()
+                self.assertIsNotNone(bx_client.fetch_resource('test_document_001', dest, chunk_size=8))
+                self.assertEqual(len(fromstring(dest.getvalue()).getchildren()), 2)
+                self.assertFalse(os.path.exists(os.path.join(res_dir, 'fake')))
+                with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                    bx_client.fetch_resource('data.bin', StringIO(), database='test_fake')
+        finally:
+            shutil.rmtree(res_dir)
+
+    def test_document_exists(self):
+        doc_id = 'test_document_001'
+        str_doc = '<tree><leaf id=\'1\'/></tree>'
+        for track_ids in (False, True):
+            with BaseXClient(self.basex_url, default_database=self.db_name,
+                             user=self.basex_user, password=self.basex_passwd,
+                             logger=get_logger('test', silent=True),
+                             track_ids=track_ids) as bx_client:
+                bx_client.create_database()
+                self.assertFalse(bx_client.document_exists(doc_id))
+                bx_client.add_document(fromstring(str_doc), doc_id)
+                self.assertTrue(bx_client.document_exists(doc_id))
+                with self.assertRaises(pbx_errors.OverwriteError):
+                    bx_client.add_document(fromstring(str_doc), doc_id)
+                ids, _ = bx_client.add_documents([fromstring(str_doc) for x in xrange(0, 5)])
+                for _id in ids:
+                    self.assertTrue(bx_client.document_exists(_id))
+                bx_client.delete_document(doc_id)
+                self.assertFalse(bx_client.document_exists(doc_id))
+                with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                    bx_client.document_exists(doc_id, database='test_fake')
+                bx_client.delete_database()
+
     def test_get_document(self):
         doc_id = 'test_document_001'
         str_doc = '<tree><leaf id=\'1\'/><leaf id=\'2\'/><leaf id=\'3\'/></tree>'
@@ -165,6 +610,58 @@ class TestBaseXClient(unittest.TestCase):
             docs = bx_client.get_documents()
             self.assertEqual(sorted(docs.keys()), sorted(bx_client.get_resources().keys()))
 
+    def test_iter_documents(self):
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            bx_client.create_database()
+            ids, _ = bx_client.add_documents(self._build_documents(25))
+            docs = list(bx_client.iter_documents(batch_size=10))
+            self.assertEqual(sorted(doc_id for doc_id, _ in docs), sorted(ids))
+            for _, doc in docs:
+                self.assertEqual(doc.tag, 'tree')
+                self.assertIsNone(doc.getparent())
+            docs = bx_client.get_documents(batch_size=5)
+            self.assertEqual(sorted(docs.keys()), sorted(ids))
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                list(bx_client.iter_documents(database='test_fake'))
+
+    def test_documents_mapping(self):
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            bx_client.create_database()
+            ids, _ = bx_client.add_documents(self._build_documents(20))
+            docs = bx_client.documents(cache_size=5)
+            self.assertEqual(len(docs), 20)
+            self.assertEqual(sorted(docs.keys()), sorted(ids))
+            self.assertIn(ids[0], docs)
+            self.assertNotIn('test_fake', docs)
+            with self.assertRaises(KeyError):
+                _ = docs['test_fake']
+            doc = docs[ids[0]]
+            self.assertEqual(doc.tag, 'tree')
+            # the parsed tree is cached
+            self.assertIs(docs[ids[0]], doc)
+            self.assertEqual(docs.cache_stats()['hits'], 1)
+            self.assertIsNone(docs.get('test_fake'))
+            for prefetch in (0, 3):
+                docs = bx_client.documents(cache_size=5, prefetch=prefetch)
+                items = dict(docs.iteritems())
+                self.assertEqual(sorted(items.keys()), sorted(ids))
+                self.assertEqual(len(docs.cache_stats()), 4)
+                self.assertEqual(docs.cache_stats()['size'], 5)
+            # the first listed document has been evicted from the cache by the iteration
+            deleted_id = docs.keys()[0]
+            bx_client.delete_document(deleted_id)
+            with self.assertRaises(KeyError):
+                _ = docs[deleted_id]
+            self.assertEqual(len(docs.values()), 19)
+            docs.refresh()
+            self.assertEqual(len(docs), 19)
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                bx_client.documents('test_fake')
+
     def test_delete_document(self):
         doc_id = 'test_document_001'
         str_doc = '<tree><leaf id=\'1\'/><leaf id=\'2\'/><leaf id=\'3\'/></tree>'
@@ -208,20 +705,271 @@ class TestBaseXClient(unittest.TestCase):
                 bx_client.execute_query('/tree//leaf[@even="0"]/ancestor-or-self::leaf',
                                         database='test_fake')
 
+    def test_execute_query_many(self):
+        databases = ['%s_%d' % (self.db_name, x) for x in xrange(0, 3)]
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True),
+                         instrumentation=MetricsCollector()) as bx_client:
+            try:
+                for x, db in enumerate(databases):
+                    bx_client.create_database(db)
+                    bx_client.add_documents(self._build_documents(4 + x), database=db)
+                results = bx_client.execute_query_many('/tree', databases + ['test_fake'],
+                                                       concurrency=2)
+                items = list(results)
+                self.assertEqual(len(items), 4 + 5 + 6)
+                self.assertEqual(Counter(db for db, _ in items),
+                                 {databases[0]: 4, databases[1]: 5, databases[2]: 6})
+                self.assertEqual(sorted(results.completed), databases)
+                self.assertIsInstance(results.errors['test_fake'], pbx_errors.UnknownDatabaseError)
+                results = bx_client.execute_query_many('/tree', databases,
+                                                       order_by=lambda t: int(t.get('id')))
+                ids = [int(tree.get('id')) for _, tree in results]
+                self.assertEqual(ids, sorted(ids))
+                self.assertEqual(len(results.errors), 0)
+                results = bx_client.execute_query_many('/tree', databases, result_format='raw')
+                self.assertEqual(sum(raw.count('<tree') for _, raw in results), 15)
+                with self.assertRaises(ValueError):
+                    bx_client.execute_query_many('/tree', databases, concurrency=0)
+                # workers are started only when the results are iterated
+                threads = threading.active_count()
+                results = [bx_client.execute_query_many('/tree', databases) for _ in xrange(0, 5)]
+                self.assertEqual(threading.active_count(), threads)
+                bx_client.instrumentation.reset()
+                self.assertEqual(len(list(results[0])), 15)
+                metrics = bx_client.instrumentation.snapshot()
+                self.assertEqual(metrics['execute_query_many']['status_codes'], {200: 3})
+            finally:
+                for db in databases:
+                    bx_client.delete_database(db)
+
+    def test_sync_documents(self):
+        manifest_dir = tempfile.mkdtemp()
+        manifest_path = os.path.join(manifest_dir, 'manifest.json')
+        documents = dict(('test_document_%03d' % x, doc) for x, doc in enumerate(self._build_documents(10)))
+        try:
+            with BaseXClient(self.basex_url, default_database=self.db_name,
+                             user=self.basex_user, password=self.basex_passwd,
+                             logger=get_logger('test', silent=True)) as bx_client:
+                bx_client.create_database()
+                summary = bx_client.sync_documents(documents, manifest=manifest_path, chunk_size=3)
+                self.assertEqual(sorted(summary['uploaded']), sorted(documents.keys()))
+                self.assertEqual(summary['unchanged'], 0)
+                self.assertEqual(len(bx_client.get_resources()), 10)
+                self.assertTrue(os.path.exists(manifest_path))
+                # equivalent serializations have the same canonical form
+                documents['test_document_001'] = '<tree  id="2"><leaf even="1"></leaf></tree>'
+                documents['test_document_002'] = '<tree id="3"><leaf even="1"/></tree>'
+                bx_client.delete_document('test_document_003')
+                summary = bx_client.sync_documents(documents, manifest=manifest_path)
+                self.assertEqual(sorted(summary['uploaded']), ['test_document_002', 'test_document_003'])
+                self.assertEqual(summary['unchanged'], 8)
+                self.assertEqual(bx_client.get_document('test_document_002').find('leaf').get('even'), '1')
+            # the manifest is persistent
+            with BaseXClient(self.basex_url, default_database=self.db_name,
+                             user=self.basex_user, password=self.basex_passwd,
+                             logger=get_logger('test', silent=True)) as bx_client:
+                del documents['test_document_009']
+                summary = bx_client.sync_documents(documents.items(), manifest=manifest_path,
+                                                   delete_missing=True)
+                self.assertEqual(summary['uploaded'], [])
+                self.assertEqual(summary['deleted'], ['test_document_009'])
+                self.assertEqual(summary['unchanged'], 9)
+                self.assertEqual(len(bx_client.get_resources()), 9)
+        finally:
+            shutil.rmtree(manifest_dir)
+
+    def test_iter_query(self):
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            bx_client.create_database()
+            _, _ = bx_client.add_documents(self._build_documents(20))
+            results = bx_client.iter_query('/tree//leaf[@even="1"]/ancestor-or-self::leaf')
+            leaves = list(results)
+            self.assertEqual(len(leaves), 10)
+            for leaf in leaves:
+                self.assertEqual(leaf.tag, 'leaf')
+                self.assertIsNone(leaf.getparent())
+            # atomic items are not dropped
+            query = '/tree[leaf/@even="1"]/string(@id)'
+            items = list(bx_client.iter_query(query))
+            self.assertTrue(items)
+            self.assertTrue(all(isinstance(item, basestring) for item in items))
+            self.assertEqual(' '.join(items).split(), bx_client.execute_query(query).text.split())
+            with self.assertRaises(pbx_errors.QueryError):
+                bx_client.iter_query('/tree//leaf[@even="0"]/ancstr-or-self::leaf')
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                bx_client.iter_query('/tree//leaf', database='test_fake')
+
+    def test_result_formats(self):
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True),
+                         query_cache=QueryCache(max_size=10)) as bx_client:
+            bx_client.create_database()
+            docs = {'test_document_%03d' % x: doc for x, doc in enumerate(self._build_documents(10))}
+            bx_client.add_documents(docs)
+            query = '/tree/leaf[@even="1"]'
+            results = bx_client.execute_query(query, result_format='raw')
+            self.assertIsInstance(results, str)
+            self.assertEqual(results.count('<leaf'), 5)
+            # results of different formats are cached separately
+            self.assertEqual(len(bx_client.execute_query(query)), 5)
+            self.assertIsInstance(bx_client.execute_query(query, result_format='raw'), str)
+            # JSON results must be a single item in the JSON representation of BaseX
+            json_query = '<json type="object"><count type="number">{ count(%s) }</count></json>' % query
+            self.assertEqual(bx_client.execute_query(json_query, result_format='json'), {'count': 5})
+            doc = bx_client.get_document('test_document_001', result_format='raw')
+            self.assertIsInstance(doc, str)
+            self.assertEqual(fromstring(doc).get('id'), '2')
+            self.assertIsNone(bx_client.get_document('test_fake', result_format='raw'))
+            raw_docs = bx_client.get_documents(batch_size=3, result_format='raw')
+            self.assertEqual(sorted(raw_docs.keys()), sorted(docs.keys()))
+            self.assertEqual(fromstring(raw_docs['test_document_009']).get('id'), '10')
+            with self.assertRaises(ValueError):
+                bx_client.execute_query(query, result_format='yaml')
+            with self.assertRaises(ValueError):
+                bx_client.get_documents(result_format='yaml')
+            json_db = '%s_json' % self.db_name
+            bx_client.create_database(json_db)
+            try:
+                for x in xrange(0, 5):
+                    bx_client.add_document(fromstring('<json type="object"><id type="number">%d</id></json>' % x),
+                                           'test_document_%03d' % x, json_db)
+                self.assertEqual(bx_client.get_document('test_document_001', json_db, result_format='json'),
+                                 {'id': 1})
+                json_docs = bx_client.get_documents(json_db, batch_size=2, result_format='json')
+                self.assertEqual(json_docs, dict(('test_document_%03d' % x, {'id': x}) for x in xrange(0, 5)))
+            finally:
+                bx_client.delete_database(json_db)
+
+    def test_query_variables(self):
+        query = 'declare variable $even external; /tree//leaf[@even=$even]/ancestor-or-self::leaf'
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True),
+                         query_cache=QueryCache(max_size=10)) as bx_client:
+            bx_client.create_database()
+            _, _ = bx_client.add_documents(self._build_documents(9))
+            results = bx_client.execute_query(query, variables={'even': '1'})
+            self.assertEqual(len(results.getchildren()), 4)
+            results = bx_client.execute_query(query, variables={'even': '0'})
+            self.assertEqual(len(results.getchildren()), 5)
+            results = list(bx_client.iter_query(query, variables={'even': '0'}))
+            self.assertEqual(len(results), 5)
+            # variables can be given as a list of pairs as well
+            results = bx_client.execute_query(query, variables=[('even', '1')])
+            self.assertEqual(len(results.getchildren()), 4)
+            pages = list(bx_client.paginate_query('/tree//leaf[@even=$even]', 3, variables=[('even', '1')]))
+            self.assertEqual([len(p) for p in pages], [3, 1])
+            results = bx_client.execute_queries(['/tree//leaf[@even=$even]', '/tree'],
+                                                variables=[('even', '0')])
+            self.assertEqual([len(r.getchildren()) for r in results], [5, 9])
+
+    def test_paginate_query(self):
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            bx_client.create_database()
+            _, _ = bx_client.add_documents(self._build_documents(25))
+            for prefetch in (True, False):
+                pages = list(bx_client.paginate_query('/tree//leaf', 10, prefetch=prefetch))
+                self.assertEqual([len(p) for p in pages], [10, 10, 5])
+            pages = list(bx_client.paginate_query('/tree//leaf[@even=$even]', 5,
+                                                  variables={'even': '1'}))
+            self.assertEqual([len(p) for p in pages], [5, 5, 2])
+            pages = list(bx_client.paginate_query('/tree//leaf', 25))
+            self.assertEqual([len(p) for p in pages], [25])
+            # atomic items are counted as well
+            pages = list(bx_client.paginate_query('/tree/string(@id)', 10))
+            self.assertEqual([len(p.text.split()) for p in pages], [10, 10, 5])
+            self.assertEqual(sorted(int(x) for p in pages for x in p.text.split()), range(1, 26))
+
+    def test_execute_queries(self):
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True)) as bx_client:
+            bx_client.create_database()
+            _, _ = bx_client.add_documents(self._build_documents(9))
+            results = bx_client.execute_queries(['/tree//leaf[@even=$even]', '/tree[@id="3"]', '/tree'],
+                                                variables={'even': '1'})
+            self.assertEqual([len(r.getchildren()) for r in results], [4, 1, 9])
+            self.assertEqual(results[1][0].get('id'), '3')
+            # errors are reported for each query, a failing query doesn't stop the others
+            results = bx_client.execute_queries(['/tree', 'error(xs:QName("err:FOER0000"))'])
+            self.assertEqual(len(results[0].getchildren()), 9)
+            self.assertIsInstance(results[1], pbx_errors.QueryError)
+            results = bx_client.execute_queries(['/tree[', '/tree[@id="1"]'])
+            self.assertIsInstance(results[0], pbx_errors.QueryError)
+            self.assertEqual(len(results[1].getchildren()), 1)
+            self.assertEqual(bx_client.execute_queries([]), [])
+
+    def test_query_cache(self):
+        query = '/tree//leaf[@even="1"]/ancestor-or-self::leaf'
+        with BaseXClient(self.basex_url, default_database=self.db_name,
+                         user=self.basex_user, password=self.basex_passwd,
+                         logger=get_logger('test', silent=True),
+                         query_cache=QueryCache(max_size=10, ttl=60)) as bx_client:
+            bx_client.create_database()
+            _, _ = bx_client.add_documents(self._build_documents(10))
+            results = bx_client.execute_query(query)
+            self.assertEqual(len(results.getchildren()), 5)
+            results.clear()
+            results = bx_client.execute_query('  %s\n' % query)
+            self.assertEqual(len(results.getchildren()), 5)
+            self.assertEqual(bx_client.query_cache.hits, 1)
+            self.assertEqual(bx_client.query_cache.misses, 1)
+            _, _ = bx_client.add_documents(self._build_documents(10))
+            results = bx_client.execute_query(query)
+            self.assertEqual(len(results.getchildren()), 10)
+            self.assertEqual(bx_client.query_cache.misses, 2)
+            # uncached queries (i.e. updates) are always executed and invalidate the cache
+            bx_client.execute_query('/tree[@id="1"]', cache=False)
+            bx_client.execute_query('/tree[@id="1"]', cache=False)
+            self.assertEqual(len(bx_client.query_cache), 0)
+            results = bx_client.execute_query(query)
+            self.assertEqual(bx_client.query_cache.misses, 3)
+            self.assertEqual(bx_client.query_cache.hits, 1)
+
 
 def suite():
     tests_suite = unittest.TestSuite()
     tests_suite.addTest(TestBaseXClient('test_connect'))
     tests_suite.addTest(TestBaseXClient('test_context_manager'))
+    tests_suite.addTest(TestBaseXClient('test_thread_sessions'))
+    tests_suite.addTest(TestBaseXClient('test_fork_safety'))
     tests_suite.addTest(TestBaseXClient('test_connection_error'))
+    tests_suite.addTest(TestBaseXClient('test_multiple_nodes'))
+    tests_suite.addTest(TestBaseXClient('test_hedged_reads'))
+    tests_suite.addTest(TestBaseXClient('test_hedged_reads_stalled_node'))
+    tests_suite.addTest(TestBaseXClient('test_metrics'))
     tests_suite.addTest(TestBaseXClient('test_create_database'))
     tests_suite.addTest(TestBaseXClient('test_delete_database'))
+    tests_suite.addTest(TestBaseXClient('test_databases_catalog'))
     tests_suite.addTest(TestBaseXClient('test_add_document'))
     tests_suite.addTest(TestBaseXClient('test_add_documents'))
+    tests_suite.addTest(TestBaseXClient('test_add_documents_parallel'))
+    tests_suite.addTest(TestBaseXClient('test_add_documents_bulk'))
+    tests_suite.addTest(TestBaseXClient('test_ingest'))
+    tests_suite.addTest(TestBaseXClient('test_buffered_writer'))
+    tests_suite.addTest(TestBaseXClient('test_resources'))
+    tests_suite.addTest(TestBaseXClient('test_document_exists'))
     tests_suite.addTest(TestBaseXClient('test_get_document'))
     tests_suite.addTest(TestBaseXClient('test_get_documents'))
+    tests_suite.addTest(TestBaseXClient('test_iter_documents'))
+    tests_suite.addTest(TestBaseXClient('test_documents_mapping'))
     tests_suite.addTest(TestBaseXClient('test_delete_document'))
     tests_suite.addTest(TestBaseXClient('test_xpath'))
+    tests_suite.addTest(TestBaseXClient('test_execute_query_many'))
+    tests_suite.addTest(TestBaseXClient('test_sync_documents'))
+    tests_suite.addTest(TestBaseXClient('test_iter_query'))
+    tests_suite.addTest(TestBaseXClient('test_query_variables'))
+    tests_suite.addTest(TestBaseXClient('test_result_formats'))
+    tests_suite.addTest(TestBaseXClient('test_paginate_query'))
+    tests_suite.addTest(TestBaseXClient('test_execute_queries'))
+    tests_suite.addTest(TestBaseXClient('test_query_cache'))
     return tests_suite
 
 if __name__ == '__main__':
@@ -0,0 +1,368 @@
+import re, socket, threading, unittest, SocketServer
+from StringIO import StringIO
+from hashlib import md5
+from lxml import etree
+from lxml.etree import fromstring, Element, SubElement, _Element
+
+from pybasex import BaseXSocketClient, HedgingPolicy
+from pybasex.utils import get_logger
+import pybasex.errors as pbx_errors
+
+STAND_IN_USER = 'admin'
+STAND_IN_PASSWD = 'admin'
+
+
+def _md5(s):
+    return md5(s).hexdigest()
+
+
+class StandInBaseXHandler(SocketServer.BaseRequestHandler):
+    """
+    A minimal implementation of the BaseX server protocol, it evaluates the queries sent
+    by pybasex and plain XPath 1.0 expressions on the documents of the opened database
+    """
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = ''
+        self.opened = None
+        self.queries = dict()
+
+    def read_byte(self):
+        if not self.buffer:
+            self.buffer = self.request.recv(4096)
+            if not self.buffer:
+                raise EOFError()
+        byte, self.buffer = self.buffer[0], self.buffer[1:]
+        return byte
+
+    def read_string(self):
+        chars = []
+        while True:
+            byte = self.read_byte()
+            if byte == '\x00':
+                return ''.join(chars)
+            if byte == '\xff':
+                byte = self.read_byte()
+            chars.append(byte)
+
+    def send_string(self, s):
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        self.request.sendall(s.replace('\xff', '\xff\xff').replace('\x00', '\xff\x00') + '\x00')
+
+    def handle(self):
+        self.request.sendall('BaseX:1234\x00')
+        user, code = self.read_string(), self.read_string()
+        if code != _md5(_md5('%s:BaseX:%s' % (STAND_IN_USER, STAND_IN_PASSWD)) + '1234') or \
+                user != STAND_IN_USER:
+            self.request.sendall('\x01')
+            return
+        self.request.sendall('\x00')
+        try:
+            while True:
+                byte = self.read_byte()
+                if byte == '\x00':
+                    self.queries[str(len(self.queries))] = (self.read_string(), dict())
+                    self.send_string(str(len(self.queries) - 1))
+                    self.request.sendall('\x00')
+                elif byte == '\x03':
+                    q_id, name, value, _ = [self.read_string() for _ in xrange(0, 4)]
+                    self.queries[q_id][1][name] = value.decode('utf-8')
+                    self.send_string('')
+                    self.request.sendall('\x00')
+                elif byte == '\x04':
+                    self.results(*self.queries[self.read_string()])
+                elif byte == '\x02':
+                    self.queries.pop(self.read_string())
+                    self.send_string('')
+                    self.request.sendall('\x00')
+                elif byte in ('\x09', '\x0c', '\x0d'):
+                    path, content = self.read_string(), self.read_string()
+                    self.server.databases[self.opened][path] = content
+                    self.send_string('Resource stored')
+                    self.request.sendall('\x00')
+                else:
+                    command = byte + self.read_string()
+                    if command == 'exit':
+                        return
+                    self.command(*command.split(' '))
+        except EOFError:
+            pass
+
+    def command(self, cmd, *args):
+        dbs = self.server.databases
+        success = True
+        if cmd == 'OPEN':
+            success = args[0] in dbs
+            self.opened = args[0] if success else None
+        elif cmd == 'CLOSE':
+            self.opened = None
+        elif cmd == 'CREATE':
+            dbs[args[1]] = dict()
+            self.opened = args[1]
+        elif cmd == 'DROP':
+            dbs.pop(args[1], None)
+        self.send_string('')
+        self.send_string('Command executed' if success else 'Command failed')
+        self.request.sendall('\x00' if success else '\x01')
+
+    def evaluate(self, text, variables):
+        dbs = self.server.databases
+        docs = dbs.get(self.opened, {})
+        if text == 'db:list-details()':
+            return ['<database resources="%d" size="1">%s</database>' % (len(d), n)
+                    for n, d in dbs.iteritems()]
+        if 'db:list-details($db)' in text:
+            return ['<resource raw="false" content-type="application/xml" size="%d">%s</resource>' %
+                    (len(c), p) for p, c in dbs[variables['db']].iteritems()]
+        if 'db:exists($db)' in text:
+            return ['true' if variables['db'] in dbs else 'false']
+        if 'db:retrieve($db, $path)' in text:
+            doc = docs.get(variables['path'])
+            return [doc] if doc is not None else []
+        if 'db:open($db, $path)' in text:
+            doc = docs.get(variables['path'])
+            return [doc] if doc else []
+        if 'db:exists($db, $path)' in text:
+            return ['true' if variables['path'] in docs else 'false']
+        if 'db:delete($db, $path)' in text:
+            docs.pop(variables['path'], None)
+            return []
+        if 'subsequence(db:open($db)' in text:
+            start, size = int(variables['start']), int(variables['size'])
+            return ['<document path="%s">%s</document>' % (p, c)
+                    for p, c in sorted(docs.items())[start - 1:start - 1 + size]]
+        updates = re.findall(r'db:(add|replace|delete)\(\$db, (?:\$p(\d+)|parse-xml\(\$d(\d+)\), \$p(\d+))',
+                             text)
+        if updates:
+            for action, p_id, d_id, add_p_id in updates:
+                path = variables['p' + (p_id or add_p_id)]
+                if action == 'delete':
+                    docs.pop(path, None)
+                else:
+                    docs[path] = variables['d' + (d_id or p_id)].encode('utf-8')
+            return []
+        xpath = re.sub(r'declare variable \$\w+ external;', '', text).strip()
+        results = []
+        for doc in docs.itervalues():
+            results.extend(etree.tostring(x) for x in fromstring(doc).getroottree().xpath(xpath, **variables))
+        return results
+
+    def results(self, text, variables):
+        try:
+            items = self.evaluate(text, variables)
+        except etree.XPathError, e:
+            self.request.sendall('\x00\x01')
+            self.send_string('Stopped at line 1: %s' % e)
+            return
+        for item in items:
+            self.request.sendall('\x01')
+            self.send_string(item)
+        self.request.sendall('\x00\x00')
+
+
+class StandInBaseXServer(SocketServer.ThreadingTCPServer):
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        SocketServer.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), StandInBaseXHandler)
+        self.databases = dict()
+
+
+class TestBaseXSocketClient(unittest.TestCase):
+
+    def __init__(self, label):
+        super(TestBaseXSocketClient, self).__init__(label)
+        self.db_name = 'test_basex'
+
+    def _build_documents(self, pool_size):
+        documents = []
+        for x in xrange(0, pool_size):
+            tree = Element('tree')
+            tree.set('id', '%s' % (x+1))
+            leaf = SubElement(tree, 'leaf')
+            leaf.set('even', '%s' % (x % 2))
+            documents.append(tree)
+        return documents
+
+    def _get_client(self, user=STAND_IN_USER, password=STAND_IN_PASSWD, url=None, **kwargs):
+        return BaseXSocketClient(url or self.server_url, default_database=self.db_name, user=user,
+                                 password=password, logger=get_logger('test', silent=True), **kwargs)
+
+    def _start_server(self):
+        server = StandInBaseXServer()
+        server_thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+        server_thread.daemon = True
+        server_thread.start()
+        return server
+
+    def setUp(self):
+        self.server = self._start_server()
+        self.server_url = 'basex://127.0.0.1:%d' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connect(self):
+        c = self._get_client()
+        with self.assertRaises(pbx_errors.ConnectionClosedError):
+            c.get_databases()
+        c.connect()
+        self.assertTrue(c.connected)
+        c.disconnect()
+        self.assertFalse(c.connected)
+        with self.assertRaises(pbx_errors.AuthenticationError):
+            self._get_client(password='wrong').connect()
+        with self.assertRaises(pbx_errors.ConnectionError):
+            BaseXSocketClient('basex://127.0.0.1:1', logger=get_logger('test', silent=True)).connect()
+
+    def test_databases(self):
+        with self._get_client() as bx_client:
+            bx_client.create_database()
+            self.assertIn(self.db_name, bx_client.get_databases())
+            with self.assertRaises(pbx_errors.OverwriteError):
+                bx_client.create_database()
+            bx_client.delete_database()
+            self.assertNotIn(self.db_name, bx_client.get_databases())
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                bx_client.delete_database()
+
+    def test_documents(self):
+        doc_id = 'test_document_001'
+        str_doc = '<tree><leaf id=\'1\'/><leaf id=\'2\'/><leaf id=\'3\'/></tree>'
+        with self._get_client() as bx_client:
+            bx_client.create_database()
+            bx_client.add_document(fromstring(str_doc), doc_id)
+            self.assertTrue(bx_client.document_exists(doc_id))
+            self.assertIn(doc_id, bx_client.get_resources())
+            doc = bx_client.get_document(doc_id)
+            self.assertIsInstance(doc, _Element)
+            self.assertEqual(len(doc.getchildren()), 3)
+            with self.assertRaises(pbx_errors.OverwriteError):
+                bx_client.add_document(fromstring(str_doc), doc_id)
+            bx_client.delete_document(doc_id)
+            self.assertIsNone(bx_client.get_document(doc_id))
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                bx_client.get_document(doc_id, database='test_fake')
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                bx_client.add_document(fromstring(str_doc), doc_id, database='test_fake')
+
+    def test_add_documents(self):
+        with self._get_client() as bx_client:
+            bx_client.create_database()
+            ids, _ = bx_client.add_documents(self._build_documents(10))
+            self.assertEqual(len(ids), 10)
+            ids, _ = bx_client.add_documents(self._build_documents(10), max_workers=3)
+            self.assertEqual(len(ids), 10)
+            ids, _ = bx_client.add_documents(self._build_documents(10), chunk_size=4)
+            self.assertEqual(len(ids), 10)
+            self.assertEqual(len(bx_client.get_resources()), 30)
+            self.assertEqual(len(bx_client.get_documents(batch_size=7)), 30)
+
+    def test_resources(self):
+        binary = ''.join(chr(x % 256) for x in xrange(0, 100000))
+        with self._get_client() as bx_client:
+            bx_client.create_database()
+            chunks = (binary[x:x + 1000] for x in xrange(0, len(binary), 1000))
+            bx_client.store_resource(chunks, 'data.bin', content_type=BaseXSocketClient.RAW_CONTENT_TYPE)
+            dest = StringIO()
+            self.assertEqual(bx_client.fetch_resource('data.bin', dest), len(binary))
+            self.assertEqual(dest.getvalue(), binary)
+            bx_client.store_resource(StringIO('<tree><leaf/></tree>'), 'test_document_001')
+            self.assertEqual(bx_client.get_document('test_document_001').tag, 'tree')
+            self.assertIsNone(bx_client.fetch_resource('test_fake', StringIO()))
+
+    def test_xpath(self):
+        with self._get_client() as bx_client:
+            bx_client.create_database()
+            _, _ = bx_client.add_documents(self._build_documents(20))
+            results = bx_client.execute_query('/tree//leaf[@even="1"]/ancestor-or-self::leaf')
+            self.assertEqual(len(results.getchildren()), 10)
+            results = list(bx_client.iter_query('declare variable $even external; /tree//leaf[@even=$even]',
+                                                variables={'even': '0'}))
+            self.assertEqual(len(results), 10)
+            with self.assertRaises(pbx_errors.QueryError):
+                bx_client.execute_query('/tree//leaf[@even="0"]/ancstr-or-self::leaf')
+            # the session is still usable after an error
+            self.assertEqual(len(bx_client.get_resources()), 20)
+            with self.assertRaises(pbx_errors.UnknownDatabaseError):
+                bx_client.execute_query('/tree//leaf', database='test_fake')
+
+    def test_nodes(self):
+        # a replica sharing the databases of the primary node and an unreachable node
+        replica = self._start_server()
+        replica.databases = self.server.databases
+        replica_url = 'basex://127.0.0.1:%d' % replica.server_address[1]
+        try:
+            with self._get_client(url=[self.server_url, replica_url, 'basex://127.0.0.1:1']) as bx_client:
+                bx_client.create_database()
+                _, _ = bx_client.add_documents(self._build_documents(10))
+                for x in xrange(0, 6):
+                    self.assertEqual(len(bx_client.get_resources()), 10)
+                self.assertEqual(bx_client.nodes.healthy_nodes(), [self.server_url, replica_url])
+                # the results of a query are still received while other requests are sent
+                # over the same connection
+                results = bx_client.iter_query('/tree')
+                self.assertEqual(next(results).tag, 'tree')
+                for x in xrange(0, 2):
+                    self.assertEqual(len(bx_client.get_resources()), 10)
+                self.assertEqual(len(list(results)), 9)
+        finally:
+            replica.shutdown()
+            replica.server_close()
+
+    def test_hedged_reads_stalled_node(self):
+        # a node accepting connections and never answering
+        stalled = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        stalled.bind(('127.0.0.1', 0))
+        stalled.listen(50)
+        accepted = list()
+
+        def accept():
+            while True:
+                try:
+                    accepted.append(stalled.accept()[0])
+                except socket.error:
+                    return
+        acceptor = threading.Thread(target=accept)
+        acceptor.daemon = True
+        acceptor.start()
+        stalled_url = 'basex://127.0.0.1:%d' % stalled.getsockname()[1]
+        try:
+            with self._get_client() as bx_client:
+                bx_client.create_database()
+                bx_client.add_document(fromstring('<tree><leaf id=\'1\'/></tree>'), 'test_document_001')
+            with self._get_client(url=[self.server_url, stalled_url],
+                                  hedging=HedgingPolicy(min_delay=0.05, max_delay=0.05, pool_size=1)) as bx_client:
+                # the connections to the stalled node are shut down when the hedges win
+                for x in xrange(0, 10):
+                    self.assertEqual(bx_client.get_document('test_document_001').tag, 'tree')
+                stats = bx_client.hedging.stats()
+                self.assertGreater(stats['won'], 0)
+                self.assertEqual(stats['won'], stats['fired'])
+                self.assertEqual(bx_client.nodes.healthy_nodes(), [self.server_url, stalled_url])
+        finally:
+            stalled.close()
+            for conn in accepted:
+                conn.close()
+
+
+def suite():
+    tests_suite = unittest.TestSuite()
+    tests_suite.addTest(TestBaseXSocketClient('test_connect'))
+    tests_suite.addTest(TestBaseXSocketClient('test_databases'))
+    tests_suite.addTest(TestBaseXSocketClient('test_documents'))
+    tests_suite.addTest(TestBaseXSocketClient('test_add_documents'))
+    tests_suite.addTest(TestBaseXSocketClient('test_resources'))
+    tests_suite.addTest(TestBaseXSocketClient('test_xpath'))
+    tests_suite.addTest(TestBaseXSocketClient('test_nodes'))
+    tests_suite.addTest(TestBaseXSocketClient('test_hedged_reads_stalled_node'))
+    return tests_suite
+
+if __name__ == '__main__':
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite())